@@ -1,14 +1,15 @@
 import model
 import data
 import feature_selection
+import training
 from data import cities
 
 def update_features_in_db(cities):
-    for city in cities:
-	feature_selection.populate_db_with_features(city)
-	print "Finished a city!"
+    feature_selection.populate_db_with_all_features()
+    print "Finished all cities!"
 def main():
     update_features_in_db(cities)
+    training.publish_model()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+
+#Binary model artifact written by the training pipeline and mapped read-only by every web worker, so all workers share one
+#page cache copy of the model instead of each building its own from the db. Layout:
+#  MAGIC, 8 byte header length, header json, then every array at a 64 byte aligned offset listed in the header.
+#The vocabulary is an open addressing hash table (crc32, linear probing) of word ids over a blob of utf-8 words.
+MAGIC = "TWMODEL1"
+ALIGNMENT = 64
+EMPTY_SLOT = -1
+
+def word_hash(word):
+    return zlib.crc32(word) & 0xffffffff
+
+def to_utf8(word):
+    if isinstance(word, unicode):
+	return word.encode("utf-8")
+    return word
+
+#Hash table with at least twice as many slots as words, a power of two so the probe can mask instead of mod
+def build_hash_table(words):
+    size = 1
+    while size < 2 * max(len(words), 1):
+	size *= 2
+    table = np.empty(size, dtype=np.int32)
+    table.fill(EMPTY_SLOT)
+    mask = size - 1
+    for word_id, word in enumerate(words):
+	slot = word_hash(word) & mask
+	while table[slot] != EMPTY_SLOT:
+	    slot = (slot + 1) & mask
+	table[slot] = word_id
+    return table
+
+#Read-only word -> id mapping over the mapped hash table. Supports the dict methods the classifier uses
+class MappedVocabulary(object):
+    def __init__(self, buf, table, word_offsets, blob_offset):
+	self.buf = buf
+	self.table = table
+	self.mask = len(table) - 1
+	self.word_offsets = word_offsets
+	self.blob_offset = blob_offset
+
+    def word(self, word_id):
+	start = self.blob_offset + int(self.word_offsets[word_id])
+	end = self.blob_offset + int(self.word_offsets[word_id + 1])
+	return self.buf[start:end]
+
+    def get(self, word, default=None):
+	word = to_utf8(word)
+	slot = word_hash(word) & self.mask
+	while True:
+	    word_id = int(self.table[slot])
+	    if word_id == EMPTY_SLOT:
+		return default
+	    if self.word(word_id) == word:
+		return word_id
+	    slot = (slot + 1) & self.mask
+
+    def __getitem__(self, word):
+	word_id = self.get(word)
+	if word_id is None:
+	    raise KeyError(word)
+	return word_id
+
+    def __contains__(self, word):
+	return self.get(word) is not None
+
+    def __len__(self):
+	return len(self.word_offsets) - 1
+
+    #utf-8 words in id order
+    def words(self):
+	return [self.word(word_id) for word_id in xrange(0, len(self))]
+
+
+#Writes the artifact to a temporary file and renames it over path, so workers that still map the old file keep a valid copy.
+#words are in word id order; arrays maps name -> numpy array (row i of a 2d array belongs to word i); header holds anything json
+def write_artifact(path, version, city_names, words, arrays, header=None):
+    words = [to_utf8(word) for word in words]
+    word_offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    word_offsets[1:] = np.cumsum([len(word) for word in words])
+    arrays = dict(arrays)
+    arrays['hash_table'] = build_hash_table(words)
+    arrays['word_offsets'] = word_offsets
+    arrays['word_blob'] = np.frombuffer("".join(words), dtype=np.uint8)
+
+    layout = {}
+    offset = 0
+    for name in sorted(arrays.keys()):
+	array = np.ascontiguousarray(arrays[name])
+	arrays[name] = array
+	layout[name] = [offset, array.dtype.str, list(array.shape)]
+	offset += array.nbytes
+	offset += -offset % ALIGNMENT
+    header = dict(header or {})
+    header.update({'version': version, 'city_names': city_names, 'arrays': layout})
+    header_json = json.dumps(header)
+    data_start = len(MAGIC) + 8 + len(header_json)
+    data_start += -data_start % ALIGNMENT
+
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'wb')
+    try:
+	f.write(MAGIC)
+	f.write(struct.pack('<Q', len(header_json)))
+	f.write(header_json)
+	for name in sorted(arrays.keys()):
+	    f.seek(data_start + layout[name][0])
+	    f.write(arrays[name].tostring())
+    finally:
+	f.close()
+    os.rename(tmp_path, path)
+
+
+#A mapped artifact. arrays are read-only numpy views straight onto the mapped file
+class ModelArtifact(object):
+    def __init__(self, path):
+	f = open(path, 'rb')
+	try:
+	    self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+	    f.close()
+	if self.buf[:len(MAGIC)] != MAGIC:
+	    raise ValueError("%s is not a model artifact" % path)
+	header_length = struct.unpack('<Q', self.buf[len(MAGIC):len(MAGIC) + 8])[0]
+	header_start = len(MAGIC) + 8
+	self.header = json.loads(self.buf[header_start:header_start + header_length])
+	data_start = header_start + header_length
+	data_start += -data_start % ALIGNMENT
+	self.version = self.header['version']
+	self.city_names = self.header['city_names']
+	self.arrays = {}
+	for name, (offset, dtype, shape) in self.header['arrays'].items():
+	    dtype = np.dtype(str(dtype))
+	    count = int(np.prod(shape))
+	    array = np.frombuffer(self.buf, dtype=dtype, count=count, offset=data_start + offset)
+	    self.arrays[name] = array.reshape(shape)
+	blob_offset = data_start + self.header['arrays']['word_blob'][0]
+	self.vocabulary = MappedVocabulary(self.buf, self.arrays['hash_table'], self.arrays['word_offsets'], blob_offset)
+
+#The artifact at path if it exists and was written for version, otherwise None
+def open_artifact(path, version):
+    if not path or not os.path.exists(path):
+	return None
+    model_artifact = ModelArtifact(path)
+    if model_artifact.version != version:
+	return None
+    return model_artifact
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+import random
+import threading
+import time
+import memcache
+
+#Two tier cache used by the web workers: a small LRU in each process in front of the shared memcached.
+#Values missing from both tiers are recomputed by one caller at a time (single flight)- across processes with a memcached add()
+#lock, so a popular key expiring does not make every worker recompute it at the same moment. TTLs are jittered for the same reason.
+#hits and misses are counted per tier, see TwoTierCache.stats
+
+#Bounded in-process cache, least recently used entries are evicted first. Entries expire after their timeout
+class LRUCache(object):
+    def __init__(self, max_size=1000):
+	self.max_size = max_size
+	self.entries = OrderedDict()
+	self.lock = threading.Lock()
+	self.hits = 0
+	self.misses = 0
+
+    #count=False looks a key up again without counting it as another hit or miss
+    def get(self, key, default=None, count=True):
+	with self.lock:
+	    entry = self.entries.pop(key, None)
+	    if entry is None or (entry[1] is not None and entry[1] < time.time()):
+		if count:
+		    self.misses += 1
+		return default
+	    self.entries[key] = entry
+	    if count:
+		self.hits += 1
+	    return entry[0]
+
+    def set(self, key, value, timeout=None):
+	with self.lock:
+	    self.entries.pop(key, None)
+	    expires = time.time() + timeout if timeout else None
+	    self.entries[key] = (value, expires)
+	    while len(self.entries) > self.max_size:
+		self.entries.popitem(last=False)
+
+    def delete(self, key):
+	with self.lock:
+	    self.entries.pop(key, None)
+
+    def clear(self):
+	with self.lock:
+	    self.entries.clear()
+
+    def __len__(self):
+	return len(self.entries)
+
+    def stats(self):
+	lookups = self.hits + self.misses
+	hit_rate = float(self.hits) / lookups if lookups else 0.0
+	return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate, 'size': len(self.entries), 'max_size': self.max_size}
+
+
+class TwoTierCache(object):
+    def __init__(self, servers, key_prefix='', local_size=1000, local_timeout=30, default_timeout=5*60, jitter=0.2,
+	    lock_timeout=30, lock_wait=5.0):
+	self.client = memcache.Client(servers)
+	self.key_prefix = key_prefix
+	self.local = LRUCache(local_size)
+	self.local_timeout = local_timeout
+	self.default_timeout = default_timeout
+	self.jitter = jitter
+	self.lock_timeout = lock_timeout
+	self.lock_wait = lock_wait
+	self.flight_lock = threading.Lock()
+	self.flights = {}
+	self.remote_hits = 0
+	self.remote_misses = 0
+	self.computed = 0
+
+    #memcached keys can't contain spaces
+    def remote_key(self, key):
+	return self.key_prefix + key.replace(" ", "_")
+
+    #timeout +/- jitter, so keys set together don't all expire together
+    def jittered(self, timeout):
+	return max(1, int(timeout * random.uniform(1 - self.jitter, 1 + self.jitter)))
+
+    #Maps each key found in either tier to its value, one memcached get_multi for whatever the local tier is missing.
+    #count=False looks the keys up again without counting more hits or misses in either tier
+    def get_many(self, keys, count=True):
+	found = {}
+	missing = []
+	for key in keys:
+	    value = self.local.get(key, count=count)
+	    if value is None:
+		missing.append(key)
+	    else:
+		found[key] = value
+	if missing:
+	    remote_keys = dict((self.remote_key(key), key) for key in missing)
+	    remote_values = self.client.get_multi(remote_keys.keys())
+	    for remote_key, value in remote_values.items():
+		key = remote_keys[remote_key]
+		found[key] = value
+		self.local.set(key, value, self.jittered(self.local_timeout))
+	    if count:
+		self.remote_hits += len(remote_values)
+		self.remote_misses += len(missing) - len(remote_values)
+	return found
+
+    def get(self, key):
+	return self.get_many([key]).get(key)
+
+    def set_many(self, mapping, timeout=None):
+	timeout = self.jittered(timeout or self.default_timeout)
+	for key, value in mapping.items():
+	    self.local.set(key, value, self.jittered(self.local_timeout))
+	self.client.set_multi(dict((self.remote_key(key), value) for key, value in mapping.items()), timeout)
+
+    def set(self, key, value, timeout=None):
+	self.set_many({key: value}, timeout)
+
+    def delete_many(self, keys):
+	for key in keys:
+	    self.local.delete(key)
+	self.client.delete_multi([self.remote_key(key) for key in keys])
+
+    #Values for every key, cached or computed. compute(missing_keys) returns {key: value} for the keys missing from both tiers.
+    #Only one thread per process, and one process holding the memcached lock, computes a missing key- the others wait up to
+    #lock_wait seconds for the value to show up and then compute it themselves
+    def get_or_compute_many(self, keys, compute, timeout=None):
+	values = self.get_many(keys)
+	missing = [key for key in keys if key not in values]
+	if not missing:
+	    return values
+	flight = self.flight_key(missing)
+	#flights maps a key being computed to [its lock, # of threads using it]. Keys carry the model version, so each entry is
+	#removed by the last thread out rather than kept for the life of the process
+	with self.flight_lock:
+	    entry = self.flights.setdefault(flight, [threading.Lock(), 0])
+	    entry[1] += 1
+	try:
+	    with entry[0]:
+		#another thread of this process may have computed them while we waited
+		for key in missing:
+		    value = self.local.get(key, count=False)
+		    if value is not None:
+			values[key] = value
+		missing = [key for key in keys if key not in values]
+		if missing:
+		    values.update(self.compute_missing(missing, compute, timeout))
+	finally:
+	    with self.flight_lock:
+		entry[1] -= 1
+		if not entry[1]:
+		    del self.flights[flight]
+	return values
+
+    def get_or_compute(self, key, compute, timeout=None):
+	return self.get_or_compute_many([key], lambda missing: {key: compute()}, timeout)[key]
+
+    def flight_key(self, keys):
+	return 'lock:' + '|'.join(sorted(keys))
+
+    def compute_missing(self, missing, compute, timeout):
+	lock_key = self.remote_key(self.flight_key(missing))
+	locked = self.client.add(lock_key, 1, self.lock_timeout)
+	#add() also fails when memcached is down- only wait when the lock is really held
+	if not locked and self.client.get(lock_key) is not None:
+	    deadline = time.time() + self.lock_wait
+	    while time.time() < deadline:
+		time.sleep(0.05)
+		values = self.get_many(missing, count=False)
+		if len(values) == len(missing):
+		    return values
+	try:
+	    values = compute(missing)
+	    self.computed += 1
+	    self.set_many(values, timeout)
+	finally:
+	    if locked:
+		self.client.delete(lock_key)
+	return values
+
+    def stats(self):
+	return {'local': self.local.stats(), 'memcached': {'hits': self.remote_hits, 'misses': self.remote_misses}, 'computed': self.computed}
@@ -0,0 +1,122 @@
+from model import Word
+from app import db
+import numpy as np
+import scipy.sparse
+import tokenizer
+import stats
+import artifact
+import config
+import data
+
+session = db.session
+
+#Words that carry no information about where a tweet came from- never scored
+STOP_WORDS = frozenset(['if', 'between', 'about', 'even', 'its', 'on', 'that', 'in', 'it', 'every', 'got', 'where', 'maybe', 'came', 'along', 'did', 'how', 'his', 'took', 'could', 'would', 'will', 'at', 'should', 'can', 'we', 'us', 'as', 'him', 'to', 'sometimes', 'you', 'were', 'i', 'my', 'her', 'he', 'me', 'this', 'was', 'had', 'all', 'the', 'but', 'or', 'and', 'there', 'is', 'then', 'a', 'an', 'be', 'for', 'of', 'what', 'when', 'why', 'are', 'am', 'because', 'they', 'she'])
+
+
+#Naive Bayes model compiled out of the words table. Holds everything needed to score a tweet so that classifying never hits the db:
+#vocabulary maps word -> row id, log_probs is a (vocabulary x cities) matrix of log P(word/city) (0.0 where the words table has no row),
+#log_priors is log P(city) per city and scored is a boolean mask over row ids for top features that are not stop words.
+class CompiledModel(object):
+    def __init__(self, city_names, vocabulary, log_probs, log_priors, scored):
+	self.city_names = city_names
+	self.city_index = dict((name, i) for i, name in enumerate(city_names))
+	self.vocabulary = vocabulary
+	self.log_probs = log_probs
+	self.log_priors = log_priors
+	self.scored = scored
+
+    #Array of ids of the words in a tweet that count towards its score, repeated words included
+    def token_ids(self, tweet_string):
+	ids = np.fromiter(tokenizer.token_ids(tweet_string, self.vocabulary), dtype=np.int32)
+	return ids[self.scored[ids]]
+
+    #log(P(City)) + log(P(w1/City)) + log(P(w2/City))... for every city at once. Repeated words are collapsed into counts first,
+    #so the gather is over distinct words and a long pasted history costs about the same as a short tweet
+    def scores(self, tweet_string):
+	ids = self.token_ids(tweet_string)
+	if not len(ids):
+	    return self.log_priors.copy()
+	unique_ids, inverse = np.unique(ids, return_inverse=True)
+	counts = np.bincount(inverse).astype(np.float64)
+	return self.log_priors + counts.dot(self.log_probs[unique_ids])
+
+    #Maps each scored word of a tweet to (# of times it occurs, count * log(P(word/City)) for every city)- the terms scores() adds
+    #to the priors
+    def contributions(self, tweet_string):
+	word_counts = {}
+	for word in tokenizer.tokenize(tweet_string):
+	    word_id = self.vocabulary.get(word)
+	    if word_id is not None and self.scored[word_id]:
+		word_counts[word] = word_counts.get(word, 0) + 1
+	return dict((word, (count, count * self.log_probs[self.vocabulary[word]])) for word, count in word_counts.items())
+
+    def score_city(self, city_name, tweet_string):
+	return self.scores(tweet_string)[self.city_index[city_name]]
+
+    #Sparse (tweets x vocabulary) matrix of scored word counts, one row per tweet
+    def document_term_matrix(self, tweet_strings):
+	indptr = [0]
+	indices = []
+	for tweet_string in tweet_strings:
+	    indices.extend(self.token_ids(tweet_string))
+	    indptr.append(len(indices))
+	counts = np.ones(len(indices))
+	return scipy.sparse.csr_matrix((counts, indices, indptr), shape=(len(indptr) - 1, len(self.vocabulary)))
+
+    #(tweets x cities) matrix of scores for a whole batch from one sparse matrix product
+    def scores_many(self, tweet_strings):
+	document_terms = self.document_term_matrix(tweet_strings)
+	return np.asarray(document_terms.dot(self.log_probs)) + self.log_priors
+
+
+#Turns the relative log scores of a tweet into P(City/Tweet), normalized over the cities
+def softmax(scores):
+    exp_scores = np.exp(scores - np.max(scores))
+    return exp_scores / exp_scores.sum()
+
+#priors overrides P(City) per city, in the order of data.cities
+#Vocabulary keys are utf-8 like the tokenizer's tokens and the artifact's vocabulary, so non-ascii words match
+def compile_model(priors=None):
+    cities = data.cities
+    city_index = dict((city.name, i) for i, city in enumerate(cities))
+    vocabulary = {}
+    rows = []
+    cols = []
+    probabilities = []
+    for word, city_name, probability in session.query(Word.word, Word.city, Word.probability):
+	word_id = vocabulary.setdefault(artifact.to_utf8(word), len(vocabulary))
+	rows.append(word_id)
+	cols.append(city_index[city_name])
+	probabilities.append(probability)
+    log_probs = np.zeros((len(vocabulary), len(cities)))
+    log_probs[rows, cols] = np.log(probabilities)
+    if priors is None:
+	priors = [data.prob_city_overall(city) for city in cities]
+    log_priors = np.log(priors)
+    scored = np.zeros(len(vocabulary), dtype=bool)
+    for word in data.get_set_of_words():
+	word = artifact.to_utf8(word)
+	if word in vocabulary and word not in STOP_WORDS:
+	    scored[vocabulary[word]] = True
+    return CompiledModel([city.name for city in cities], vocabulary, log_probs, log_priors, scored)
+
+#Compiled once per worker and then reused for every request
+#The model arrays are views onto the mapped artifact, so nothing is copied into the worker
+def model_from_artifact(model_artifact):
+    arrays = model_artifact.arrays
+    return CompiledModel(model_artifact.city_names, model_artifact.vocabulary, arrays['log_probs'], arrays['log_priors'], arrays['scored'])
+
+def load_model():
+    model_artifact = artifact.open_artifact(config.MODEL_ARTIFACT, stats.current_model_version())
+    if model_artifact:
+	print "mapped classification model from %s" % config.MODEL_ARTIFACT
+	return model_from_artifact(model_artifact)
+    compiled_model = compile_model()
+    print "compiled classification model from db"
+    return compiled_model
+
+#Loaded once per worker and reloaded when the model version changes (see stats.py)
+MODEL = stats.VersionedCache(load_model)
+def get_model():
+    return MODEL.get()
@@ -5,3 +5,8 @@ SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "postgresql://localhost
 #SQLALCHEMY_DATABASE_URI = "postgresql://localhost/twitter" 
 #SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, 'twitter.db')
 SQLALCHEMY_MIGRATE_REPO = os.path.join(basedir, 'db_repository')
+#Memory-mapped model written by the training scripts and shared by the web workers (see artifact.py). Workers fall back to the db when it is missing
+MODEL_ARTIFACT = os.environ.get("MODEL_ARTIFACT", os.path.join(basedir, 'model.bin'))
+#Number of ranked features kept per city in the features table- serving reads at most the top 500 (data.TOP_FEATURE_COUNT).
+#The rank of every word, which the tweet explanations show, is kept in city_word_counts.feature_rank instead
+FEATURE_LIMIT = int(os.environ.get("FEATURE_LIMIT", 500))
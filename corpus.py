@@ -0,0 +1,166 @@
+from model import Vocabulary, CityWordCount
+from app import db
+from sqlalchemy import func, and_, bindparam
+import numpy as np
+
+#Storage for the per-city word counts: one vocabulary row per word and one city_word_counts row per (city, word) that occurs.
+#One city's counts or one word's counts across cities are a single indexed query- nothing has to decode the whole corpus.
+#Cities are referred to by region id (city.id).
+
+session = db.session
+
+#Rows per executemany and words per IN (...) query
+CHUNK_SIZE = 5000
+
+def is_empty():
+    return session.query(CityWordCount).first() is None
+
+#Throws away the stored counts and replaces them. term_counts and doc_counts map city id -> {word: count}
+def replace_counts(term_counts, doc_counts):
+    words = set()
+    for word_counts in term_counts.values():
+	words |= set(word_counts.keys())
+    word_ids = {}
+    vocabulary_rows = []
+    for word in sorted(words):
+	word_ids[word] = len(word_ids) + 1
+	vocabulary_rows.append({'id': word_ids[word], 'word': to_unicode(word)})
+    count_rows = []
+    for city_id, word_counts in term_counts.items():
+	city_doc_counts = doc_counts[city_id]
+	for word, term_count in word_counts.items():
+	    count_rows.append({'city_id': city_id, 'word_id': word_ids[word], 'term_count': term_count, 'doc_count': city_doc_counts.get(word, 0)})
+
+    session.execute(CityWordCount.__table__.delete())
+    session.execute(Vocabulary.__table__.delete())
+    insert_rows(Vocabulary.__table__, vocabulary_rows)
+    insert_rows(CityWordCount.__table__, count_rows)
+    session.commit()
+
+#Adds counts for new tweets to the stored ones. term_deltas and doc_deltas map city id -> {word: count to add}.
+#Returns the set of words that weren't in the vocabulary before
+def add_counts(term_deltas, doc_deltas):
+    words = set()
+    for word_counts in term_deltas.values():
+	words |= set(to_unicode(word) for word in word_counts.keys())
+    word_ids = get_word_ids(words)
+    new_words = words - set(word_ids.keys())
+    next_id = (session.query(func.max(Vocabulary.id)).scalar() or 0) + 1
+    vocabulary_rows = []
+    for word in sorted(new_words):
+	word_ids[word] = next_id
+	vocabulary_rows.append({'id': next_id, 'word': word})
+	next_id += 1
+    insert_rows(Vocabulary.__table__, vocabulary_rows)
+
+    table = CityWordCount.__table__
+    update = table.update().where(and_(table.c.city_id==bindparam('c_id'), table.c.word_id==bindparam('w_id'))).values(
+	    term_count=table.c.term_count + bindparam('term_delta'), doc_count=table.c.doc_count + bindparam('doc_delta'))
+    for city_id, word_counts in term_deltas.items():
+	city_doc_deltas = doc_deltas[city_id]
+	deltas = dict((word_ids[to_unicode(word)], (count, city_doc_deltas.get(word, 0))) for word, count in word_counts.items())
+	existing = set()
+	ids = deltas.keys()
+	for i in range(0, len(ids), CHUNK_SIZE):
+	    query = session.query(CityWordCount.word_id).filter(CityWordCount.city_id==city_id).filter(CityWordCount.word_id.in_(ids[i:i + CHUNK_SIZE]))
+	    existing |= set(word_id for (word_id,) in query)
+	updates = [{'c_id': city_id, 'w_id': word_id, 'term_delta': deltas[word_id][0], 'doc_delta': deltas[word_id][1]} for word_id in existing]
+	inserts = [{'city_id': city_id, 'word_id': word_id, 'term_count': delta[0], 'doc_count': delta[1]} for word_id, delta in deltas.items() if word_id not in existing]
+	if updates:
+	    session.execute(update, updates)
+	insert_rows(table, inserts)
+    return new_words
+
+#{word: term count} in one city for just the given words
+def city_term_counts(city_id, words):
+    words = [to_unicode(word) for word in words]
+    counts = {}
+    for i in range(0, len(words), CHUNK_SIZE):
+	query = session.query(Vocabulary.word, CityWordCount.term_count).join(CityWordCount, CityWordCount.word_id==Vocabulary.id).filter(CityWordCount.city_id==city_id).filter(Vocabulary.word.in_(words[i:i + CHUNK_SIZE]))
+	counts.update(query)
+    return counts
+
+#{city id: (term count, doc count)} for one word, only cities the word occurs in
+def word_counts(word):
+    query = session.query(CityWordCount.city_id, CityWordCount.term_count, CityWordCount.doc_count).join(Vocabulary, CityWordCount.word_id==Vocabulary.id).filter(Vocabulary.word==to_unicode(word))
+    return dict((city_id, (term_count, doc_count)) for city_id, term_count, doc_count in query)
+
+#({city id: {word: term count}}, {city id: {word: doc count}}) for the whole corpus
+def all_counts(city_ids):
+    term_counts = dict((city_id, {}) for city_id in city_ids)
+    doc_counts = dict((city_id, {}) for city_id in city_ids)
+    query = session.query(CityWordCount.city_id, Vocabulary.word, CityWordCount.term_count, CityWordCount.doc_count).join(Vocabulary, CityWordCount.word_id==Vocabulary.id)
+    for city_id, word, term_count, doc_count in query:
+	term_counts[city_id][word] = term_count
+	doc_counts[city_id][word] = doc_count
+    return term_counts, doc_counts
+
+#{city id: {word: term count}} for the whole corpus
+def all_term_counts(city_ids):
+    term_counts = dict((city_id, {}) for city_id in city_ids)
+    query = session.query(CityWordCount.city_id, Vocabulary.word, CityWordCount.term_count).join(Vocabulary, CityWordCount.word_id==Vocabulary.id)
+    for city_id, word, term_count in query:
+	term_counts[city_id][word] = term_count
+    return term_counts
+
+#(words, counts)- every vocabulary word in id order and a (words x cities) array of term counts, columns in the order of city_ids
+def term_count_matrix(city_ids):
+    return count_matrix(city_ids, CityWordCount.term_count)
+
+#Same as term_count_matrix with the # of tweets each word occurs in
+def doc_count_matrix(city_ids):
+    return count_matrix(city_ids, CityWordCount.doc_count)
+
+def count_matrix(city_ids, count_column):
+    word_ids = []
+    words = []
+    for word_id, word in session.query(Vocabulary.id, Vocabulary.word).order_by(Vocabulary.id):
+	word_ids.append(word_id)
+	words.append(word)
+    rows = dict((word_id, i) for i, word_id in enumerate(word_ids))
+    columns = dict((city_id, j) for j, city_id in enumerate(city_ids))
+    counts = np.zeros((len(words), len(city_ids)))
+    for city_id, word_id, count in session.query(CityWordCount.city_id, CityWordCount.word_id, count_column):
+	counts[rows[word_id], columns[city_id]] = count
+    return words, counts
+
+def get_word_ids(words):
+    words = list(words)
+    word_ids = {}
+    for i in range(0, len(words), CHUNK_SIZE):
+	word_ids.update(session.query(Vocabulary.word, Vocabulary.id).filter(Vocabulary.word.in_(words[i:i + CHUNK_SIZE])))
+    return word_ids
+
+def all_words():
+    return [word for (word,) in session.query(Vocabulary.word)]
+
+def vocabulary_size():
+    return session.query(func.count(Vocabulary.id)).scalar()
+
+#Total number of words in one city's tweets
+def city_term_total(city_id):
+    return session.query(func.coalesce(func.sum(CityWordCount.term_count), 0)).filter(CityWordCount.city_id==city_id).scalar()
+
+#Stores one city's full feature ranking- words best first- as the feature_rank of its rows, clearing the old ranks
+def replace_feature_ranks(city_id, ranked_words):
+    table = CityWordCount.__table__
+    session.execute(table.update().where(table.c.city_id==city_id).values(feature_rank=None))
+    word_ids = get_word_ids([to_unicode(word) for word in ranked_words])
+    update = table.update().where(and_(table.c.city_id==bindparam('c_id'), table.c.word_id==bindparam('w_id'))).values(feature_rank=bindparam('rank'))
+    updates = [{'c_id': city_id, 'w_id': word_ids[to_unicode(word)], 'rank': rank} for rank, word in enumerate(ranked_words)]
+    for i in range(0, len(updates), CHUNK_SIZE):
+	session.execute(update, updates[i:i + CHUNK_SIZE])
+
+#(word, city id, feature rank) for every ranked (city, word)
+def feature_ranks():
+    return session.query(Vocabulary.word, CityWordCount.city_id, CityWordCount.feature_rank).join(CityWordCount, CityWordCount.word_id==Vocabulary.id).filter(CityWordCount.feature_rank!=None).all()
+
+def insert_rows(table, rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+	session.execute(table.insert(), rows[i:i + CHUNK_SIZE])
+
+#Words come out of the tokenizer as utf-8 byte strings
+def to_unicode(word):
+    if isinstance(word, unicode):
+	return word
+    return word.decode("utf-8")
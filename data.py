@@ -1,16 +1,23 @@
 from model import Word, Features, Container, Tweet, Boston, San_Francisco, Los_Angeles, Houston, New_York, Atlanta, Chicago, Miami, Seattle
 from math import sqrt, log, sin, cos, radians, atan2
 from app import db
-import math
 import model
-import string
 import operator
 import haversine
+import tokenizer
+import regions
+import corpus
+import classifier
+import stats
+import numpy as np
 from operator import itemgetter 
-from werkzeug.contrib.cache import MemcachedCache
-cache = MemcachedCache(['127.0.0.1:11211'])
+from cache import TwoTierCache
+#In-process LRU in front of memcached (see cache.py)
+cache = TwoTierCache(['127.0.0.1:11211'], key_prefix='twitter_map:')
 import json
-import datetime
+import itertools
+import multiprocessing
+import tempfile
 
 
 # Main Naiive Bayes classification equation derived from http://nlp.stanford.edu/IR-book/html/htmledition/naive-bayes-text-classification-1.html
@@ -41,24 +48,37 @@ def distanceIsWithinHundredMiles(lon1,lat1,lon2,lat2):
 	return False 
 
 
-#Returns list of US tweets- Note: To increase speed I have placed indexes on longitude and latitude in tweets table using Postgresql.
-ALL_TWEETS = []
+#Query for US tweets- Note: To increase speed I have placed indexes on longitude and latitude in tweets table using Postgresql.
+#Retweets are filtered out in the query rather than in python
+def us_tweets_query(*entities):
+    if not entities:
+	entities = (Tweet,)
+    return session.query(*entities).filter(Tweet.longitude > -125.0).filter(Tweet.longitude < -65.0).filter(Tweet.latitude > 25.0).filter(Tweet.latitude < 50.0).filter(~Tweet.text.startswith("RT"))
+
+#Query for the US tweets assigned to a city. Uses the index on tweets.city filled in when tweets are loaded
+def city_tweets_query(city, *entities):
+    return us_tweets_query(*entities).filter(Tweet.city==city.id)
+
+#Generator over the rows of a query for downstream stages. Rows come from a server side cursor TWEET_BATCH_SIZE at a time, so the
+#tweets table never has to fit in memory
+TWEET_BATCH_SIZE = 1000
+def stream_query(query):
+    for row in query.execution_options(stream_results=True).yield_per(TWEET_BATCH_SIZE):
+	yield row
+
+#Generator over US tweets. Pass columns (e.g. Tweet.text, Tweet.longitude, Tweet.latitude) to skip building Tweet objects
+def iter_tweets(*entities):
+    return stream_query(us_tweets_query(*entities))
+
+#Returns list of US tweets
 def get_tweet_list():
-    global ALL_TWEETS
-    if ALL_TWEETS:
-	return ALL_TWEETS
-
-    all_tweets = session.query(Tweet).filter(Tweet.longitude > -125.0).filter(Tweet.longitude < -65.0).filter(Tweet.latitude > 25.0).filter(Tweet.latitude < 50.0).all()
-    list_of_tweets = []
-    for tweet in all_tweets:
-	if tweet.text.startswith("RT"):
-	    continue
-	else:
-	    list_of_tweets.append(tweet)
+    return list(iter_tweets())
 
-    ALL_TWEETS = list_of_tweets
-    print "updating tweet list from db"
-    return ALL_TWEETS
+#Same test get_tweet_list applies, for tweets that haven't gone through the db query- inside the US bounding box and not a retweet
+def is_us_tweet(tweet):
+    if tweet.text.startswith("RT"):
+	return False
+    return -125.0 < tweet.longitude < -65.0 and 25.0 < tweet.latitude < 50.0
 
 
 #Pythagorean theorem with haversine to account for earth's curvature. Calculates distance between tweet and city
@@ -66,76 +86,252 @@ def distance_between_2_points((lon1, lat1),(lon2, lat2)):
     d = haversine.haversine(lon1, lat1, lon2, lat2)
     return float(d)
 
+#Distances to every city are computed for all the tweets at once by the region index
+REGION_INDEX = regions.RegionIndex(cities)
+CITIES_BY_ID = dict((city.id, city) for city in cities)
+
+#Returns (city ids, distances in km to the closest city) for lists of coordinates. The id is None when no city is within 150 miles-
+#these are the values stored in tweets.city and tweets.distance_km
+def assign_cities(lons, lats):
+    region_ids, distances = REGION_INDEX.assign(lons, lats)
+    city_ids = []
+    for region_id in region_ids:
+	if region_id == regions.NO_REGION:
+	    city_ids.append(None)
+	else:
+	    city_ids.append(int(region_id))
+    return city_ids, [float(distance) for distance in distances]
+
 #Return list of tweets and their corresponding, closest city, given that the city is within 150 miles of the tweet 
 def closest_major_cities(list_of_tweets):
+    lons = [tweet.longitude for tweet in list_of_tweets]
+    lats = [tweet.latitude for tweet in list_of_tweets]
+    region_ids, distances = REGION_INDEX.assign(lons, lats)
     tweet_cities = []
-    for tweet in list_of_tweets:
-	closest_city = cities[0]
-	for i in range(1, len(cities)):
-	    new_city = cities[i]
-	    if distance_between_2_points((closest_city.lon, closest_city.lat),(tweet.longitude,tweet.latitude)) > distance_between_2_points((new_city.lon, new_city.lat), (tweet.longitude,tweet.latitude)):
-		closest_city = new_city 
-	if distanceIsWithinHundredMiles(tweet.longitude, tweet.latitude, closest_city.lon, closest_city.lat):
-	    tweet_cities.append((tweet, closest_city))
+    for i in range(0, len(list_of_tweets)):
+	if region_ids[i] != regions.NO_REGION:
+	    tweet_cities.append((list_of_tweets[i], CITIES_BY_ID[region_ids[i]]))
     return tweet_cities
 
+#Yields (city, list of words) for every US tweet that belongs to a city, streamed from the db without loading Tweet objects.
+#Cities come from the stored tweets.city column. With shards > 1 only the tweets whose id % shards == shard are read
+def iter_city_tweet_words(shard=0, shards=1):
+    query = us_tweets_query(Tweet.city, Tweet.text).filter(Tweet.city!=None)
+    if shards > 1:
+	query = query.filter(Tweet.id % shards == shard)
+    rows = stream_query(query)
+    tweet_rows, tweet_texts = itertools.tee(rows)
+    words = tokenizer.tokenize_many(row.text for row in tweet_texts)
+    for row, tweet_words in itertools.izip(tweet_rows, words):
+	yield CITIES_BY_ID[row.city], tweet_words
+
 #Returns dictionary with cities/instances as keys and values of lists of the corresponding tweets for each city 
 CITY_TWEET_MAP = None
 def map_cities_to_tweets():
     global CITY_TWEET_MAP
     if CITY_TWEET_MAP:
 	return CITY_TWEET_MAP
-    list_of_us_tweets = get_tweet_list()	
-    major_cities = closest_major_cities(list_of_us_tweets)
     tweet_to_city_dict = {}
-    for i in range(0, len(major_cities)):
-	tweet = major_cities[i][0]
-	city_name = major_cities[i][1].name
-	if city_name not in tweet_to_city_dict:
-	    tweet_to_city_dict[city_name] = [tweet]
-	else:
-	    previous = tweet_to_city_dict[city_name]
-	    tweet_to_city_dict[city_name] = tweet_to_city_dict[city_name] + [tweet] 
+    for city in cities:
+	tweet_to_city_dict[city.name] = list(stream_query(city_tweets_query(city)))
     CITY_TWEET_MAP = tweet_to_city_dict
     print "updating new city_tweet_map from db" 
     return CITY_TWEET_MAP
 
-#Seeds into db dictionary inside dictionary, maps city names to key-value pair of word to # of tweets in city that word occurs in.
-def city_tweet_corpus_dict():
-    key = 'city_tweet_corpus_dict'
-    n = session.query(Container).filter(Container.key==key).first()
-    if not n:
-	n={}
-	tweet_to_city_dict = map_cities_to_tweets()
-	for city in cities:
-	    city_tweet_corpus_dict = {}
-
-	    for tweet in tweet_to_city_dict[city.name]:
-		tweet_text = tweet.text.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split()
-		uniques = set(tweet_text)
-		tweet_text = list(uniques)
-		for word in tweet_text:
-		    if word not in city_tweet_corpus_dict:
-			city_tweet_corpus_dict[word]=1
-		    else:
-			previous = city_tweet_corpus_dict[word]
-			city_tweet_corpus_dict[word] = previous+1
-	    n[city.name] = city_tweet_corpus_dict
-	d = Container(key=key, value=json.dumps(n))
-	model.session.add(d)
-	model.session.commit()
+#Name, position, tweet count and share of all tweets of every city, for the home page map. Built from the worker's statistics
+#snapshot rather than the tweets and cached per model version
+def map_data():
+    corpus_stats = stats.get_stats()
+    return cache.get_or_compute('map_data_%d' % corpus_stats.version, lambda: build_map_data(corpus_stats))
+
+def build_map_data(corpus_stats):
+    city_data = []
+    for city in cities:
+	city_data.append({'name': city.name, 'lat': city.lat, 'lon': city.lon, 'tweet_count': corpus_stats.city_tweet_counts[city.name],
+	    'share': corpus_stats.priors[city.name]})
+    return city_data
+
+#Tweets per map tile of every city at one zoom level, see training.build_heatmaps
+def heatmap_key(zoom):
+    return 'heatmap_%d' % zoom
+
+def stored_heatmap(zoom):
+    container = session.query(Container).filter(Container.key==heatmap_key(zoom)).first()
+    if not container:
+	return None
+    return json.loads(container.value)
+
+#The stored heatmap, cached per model version
+def heatmap(zoom):
+    version = stats.get_stats().version
+    return cache.get_or_compute('%s_%d' % (heatmap_key(zoom), version), lambda: stored_heatmap(zoom))
+
+#Counts every word of every city's tweets and stores them in the vocabulary and city_word_counts tables: the # of times each word
+#occurs in a city and the # of tweets in the city that word occurs in. Tweets are sharded by id over a pool of processes
+#(one per core by default), each shard is counted in a single pass and the partial counts are merged here
+def build_city_word_counts(processes=None):
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+	term_counts, doc_counts = count_city_words((0, 1))
     else:
-	n = json.loads(n.value)
+	#forked workers must not inherit the parent's open db connections
+	session.remove()
+	db.engine.dispose()
+	pool = multiprocessing.Pool(processes, initializer=init_count_worker)
+	try:
+	    term_counts = None
+	    for shard_term_counts, shard_doc_counts in pool.imap_unordered(count_city_words, [(shard, processes) for shard in range(0, processes)]):
+		if term_counts is None:
+		    term_counts, doc_counts = shard_term_counts, shard_doc_counts
+		else:
+		    merge_counts(term_counts, shard_term_counts)
+		    merge_counts(doc_counts, shard_doc_counts)
+	finally:
+	    pool.close()
+	    pool.join()
+    corpus.replace_counts(term_counts, doc_counts)
+    stats.STATS.clear()
+
+def init_count_worker():
+    db.engine.dispose()
+
+#Map step of build_city_word_counts- term and doc counts per city id for one shard of the tweets, in a single pass
+def count_city_words(shard_and_shards):
+    shard, shards = shard_and_shards
+    term_counts = dict((city.id, {}) for city in cities)
+    doc_counts = dict((city.id, {}) for city in cities)
+    for city, tweet_text in iter_city_tweet_words(shard, shards):
+	city_term_counts = term_counts[city.id]
+	for word in tweet_text:
+	    if word not in city_term_counts:
+		city_term_counts[word]=1
+	    else:
+		city_term_counts[word] += 1
+	city_doc_counts = doc_counts[city.id]
+	for word in set(tweet_text):
+	    if word not in city_doc_counts:
+		city_doc_counts[word]=1
+	    else:
+		city_doc_counts[word] += 1
+    return term_counts, doc_counts
+
+#Reduce step- adds one shard's {city id: {word: count}} into the running totals
+def merge_counts(total_counts, shard_counts):
+    for city_id, counts in shard_counts.items():
+	city_total_counts = total_counts[city_id]
+	for word, count in counts.items():
+	    city_total_counts[word] = city_total_counts.get(word, 0) + count
+
+def ensure_city_word_counts():
+    if corpus.is_empty():
+	print 'Couldn\'t get city word counts from database'
+	build_city_word_counts()
+
+#Dictionary inside dictionary, maps city names to key-value pair of word to # of tweets in city that word occurs in.
+#Reads the whole corpus- use word_counts_by_city when only one word is needed
+def city_tweet_corpus_dict():
+    ensure_city_word_counts()
+    term_counts, doc_counts = corpus.all_counts([city.id for city in cities])
+    n = {}
+    for city in cities:
+	n[city.name] = doc_counts[city.id]
     return n 
 
+#Maps city name to (count of word occurrance, # of tweets word occurs in) for every city the word occurs in
+def word_counts_by_city(word):
+    ensure_city_word_counts()
+    return dict((CITIES_BY_ID[city_id].name, counts) for city_id, counts in corpus.word_counts(word).items())
 
-#Seeds into words table, city, word, and prob(W/City)
+
+#Seeds into words table, city, word, and prob(W/City) for every word of the corpus and every city.
+#P(W/City) is computed for the whole (words x cities) count matrix at once- same smoothing as prob_word_given_city- and the
+#rows are written in bulk into a fresh words table
 def seed_words_table():
-    uniques = total_corpus_list()
-    for word in uniques:
-	n = Word(word = word, city = city.name, probability = prob_word_given_city(city, word))
-	model.session.add(n)
-	model.session.commit()
+    ensure_city_word_counts()
+    words, term_counts = corpus.term_count_matrix([city.id for city in cities])
+    denominators = term_counts.sum(axis=0) + len(words)
+    probabilities = (term_counts + 1.0)/denominators
+    if db.engine.dialect.name == 'postgresql':
+	copy_words_table(words, probabilities)
+    else:
+	insert_words_table(words, probabilities)
+    save_word_denominators(dict((city.name, float(denominators[j])) for j, city in enumerate(cities)))
+    session.commit()
+    print "seeded words table with %d rows" % probabilities.size
+
+#Denominators of P(W/City) the words table rows are normalized with, by city name. Incremental updates write their rows against
+#these and training.publish_model rescales the whole table to the current ones
+WORD_DENOMINATORS_KEY = 'word_denominators'
+
+#Tables seeded before the denominators were stored were normalized with the corpus as it was, the best guess being as it is now
+def word_denominators():
+    container = session.query(Container).filter(Container.key==WORD_DENOMINATORS_KEY).first()
+    if container:
+	return json.loads(container.value)
+    vocabulary_size = corpus.vocabulary_size()
+    return dict((city.name, float(corpus.city_term_total(city.id) + vocabulary_size)) for city in cities)
+
+#Not committed- goes in with the words table rows it describes
+def save_word_denominators(denominators):
+    container = session.query(Container).filter(Container.key==WORD_DENOMINATORS_KEY).first()
+    if not container:
+	container = Container(key=WORD_DENOMINATORS_KEY)
+    container.value = json.dumps(denominators)
+    session.add(container)
+
+#(id, word, city name, probability) for every cell of the probability matrix
+def iter_word_rows(words, probabilities):
+    row_id = 0
+    for i in range(0, len(words)):
+	for j in range(0, len(cities)):
+	    row_id += 1
+	    yield row_id, words[i], cities[j].name, float(probabilities[i, j])
+
+#Postgres: COPY the rows into words_new, index it and swap it in for words in one transaction, so the classifier never sees
+#a half written table. Words come out of the tokenizer, so they contain no tabs, newlines or backslashes to escape for COPY
+def copy_words_table(words, probabilities):
+    rows = tempfile.TemporaryFile()
+    for row_id, word, city_name, probability in iter_word_rows(words, probabilities):
+	rows.write(("%d\t%s\t%s\t%r\n" % (row_id, word, city_name, probability)).encode("utf-8"))
+    rows.seek(0)
+    connection = db.engine.raw_connection()
+    try:
+	cursor = connection.cursor()
+	cursor.execute("DROP TABLE IF EXISTS words_new")
+	cursor.execute("CREATE TABLE words_new (id INTEGER NOT NULL, word VARCHAR(500) NOT NULL, city VARCHAR(64) NOT NULL, probability FLOAT(8) NOT NULL)")
+	cursor.copy_from(rows, 'words_new', columns=('id', 'word', 'city', 'probability'))
+	cursor.execute("ALTER TABLE words_new ADD CONSTRAINT words_new_pkey PRIMARY KEY (id)")
+	cursor.execute("CREATE INDEX words_new_city ON words_new (city)")
+	cursor.execute("CREATE INDEX words_new_word ON words_new (word)")
+	cursor.execute("DROP TABLE words")
+	cursor.execute("ALTER TABLE words_new RENAME TO words")
+	cursor.execute("ALTER INDEX words_new_pkey RENAME TO words_pkey")
+	cursor.execute("ALTER INDEX words_new_city RENAME TO ix_words_city")
+	cursor.execute("ALTER INDEX words_new_word RENAME TO ix_words_word")
+	#the old id sequence went with the old table- new words added by training.add_tweets still need one
+	cursor.execute("CREATE SEQUENCE words_id_seq OWNED BY words.id")
+	cursor.execute("ALTER TABLE words ALTER COLUMN id SET DEFAULT nextval('words_id_seq')")
+	cursor.execute("SELECT setval('words_id_seq', %s)", (max(probabilities.size, 1),))
+	connection.commit()
+    except Exception:
+	connection.rollback()
+	raise
+    finally:
+	connection.close()
+	rows.close()
+
+#Other databases (sqlite in development): empty the table and executemany the rows in batches
+def insert_words_table(words, probabilities):
+    session.query(Word).delete(synchronize_session=False)
+    batch = []
+    for row_id, word, city_name, probability in iter_word_rows(words, probabilities):
+	batch.append({'id': row_id, 'word': word, 'city': city_name, 'probability': probability})
+	if len(batch) == corpus.CHUNK_SIZE:
+	    session.execute(Word.__table__.insert(), batch)
+	    batch = []
+    if batch:
+	session.execute(Word.__table__.insert(), batch)
+    session.commit()
 
 
 
@@ -143,69 +339,32 @@ def seed_words_table():
 # Begin Bayesian Problem
 
 #Creates a dictionary inside dictionary, maps city name to key-value pairs of word in city to overall count of word occurrance in that city
+#Reads the whole corpus- use word_counts_by_city when only one word is needed
 def city_corpus_dict():
-    key = 'city_corpus_dict'
-    n = session.query(Container).filter(Container.key==key).first()
-    if not n:
-	print 'Couldn\'t get city corpus dict from database'
-	tweet_to_city_dict = map_cities_to_tweets()
-	n = {}
-	for city in cities:
-	    city_corpus_dict = {}
-	    for tweet in tweet_to_city_dict[city.name]:
-		tweet_text = tweet.text.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split()
-		for word in tweet_text:
-		    if word not in city_corpus_dict:
-			city_corpus_dict[word]=1
-		    else:
-			previous = city_corpus_dict[word]
-			city_corpus_dict[word] = previous+1
-	    n[city.name] = city_corpus_dict
-	d = Container(key=key, value=json.dumps(n))
-	model.session.add(d)
-	model.session.commit()
-    else:
-	n = json.loads(n.value)
+    ensure_city_word_counts()
+    term_counts, doc_counts = corpus.all_counts([city.id for city in cities])
+    n = {}
+    for city in cities:
+	n[city.name] = term_counts[city.id]
     return n
 
-#Memcaches key:city to value:total word count in city. Good use of Memcached because total word count of city stays constant for every call of function P(W/city) 
+#Total word count in city, read from the worker's corpus statistics snapshot (see stats.py)
 def create_city_word_count(city):
-    key = city.name.replace(" ", "_")
-    total_city_count = cache.get(key)
-    print "did not miss memcache for city_word_count"
-    if total_city_count is None:
-	print "Missed the cache tota_city_count: %s" %  key
-	container = city_corpus_dict()
-	word_count_dict = container[city.name] 
-	words = word_count_dict.keys()
-	total_city_count = 0.0
-	for word in words:
-	    total_city_count += word_count_dict[word] 
-	cache.set(key, total_city_count, timeout=5*60)
-    return total_city_count 
+    return stats.get_stats().city_word_totals[city.name]
 
 #Returns total word count for all cities combined
 def create_total_word_count():
-    container = city_corpus_dict() 
-    city_names = container.keys()
     total_count = 0.0
-    for city_name in city_names:
-	word_count_dict = container[city_name] 
-	words = word_count_dict.keys()
-	for word in words:
-	    total_count += word_count_dict[word] 
+    for city in cities:
+	total_count += create_city_word_count(city)
     return float(total_count) 
 
 #Returns the # of total tweets in a city- Called when calculating Mutual Information Scores N10, N00, N01, N11
 def create_region_tweet_count(city):
-    key = city.name.replace(' ', '_') + 'tweet_count'
+    key = region_tweet_count_key(city)
     region_tweet_count = session.query(Container).filter(Container.key==key).first()
     if not region_tweet_count:
-	tweet_to_cty_dict = map_cities_to_tweets()
-	tweet_list = tweet_to_cty_dict[city.name]
-	region_tweet_count = 0.0
-	for tweet in tweet_list:
-	    region_tweet_count += 1.0
+	region_tweet_count = float(city_tweets_query(city).count())
 	d = Container(key=key, value=json.dumps(region_tweet_count))
 	model.session.add(d)
 	model.session.commit()
@@ -213,17 +372,22 @@ def create_region_tweet_count(city):
 	region_tweet_count = json.loads(region_tweet_count.value)
     return region_tweet_count 
 
+#Maps city name to the # of tweets in the city, for display. Read through the cache with one memcached round trip for all cities-
+#training reads create_region_tweet_count directly so it never sees a stale count
+def region_tweet_counts():
+    keys = dict((region_tweet_count_key(city), city) for city in cities)
+    counts = cache.get_or_compute_many(keys.keys(), lambda missing: dict((key, create_region_tweet_count(keys[key])) for key in missing))
+    return dict((city.name, counts[key]) for key, city in keys.items())
+
+def region_tweet_count_key(city):
+    return city.name.replace(' ', '_') + 'tweet_count'
+
 #Returns the # of total tweets overall- Called when calculating Mutual Information Scores N10, N00, N01, N11
 def create_tweet_total_count():
     key = 'total_tweet_count' 
     total_tweet_count = session.query(Container).filter(Container.key==key).first()
     if not total_tweet_count:
-	tweet_to_cty_dict = map_cities_to_tweets()
-	total_tweet_count = 0.0
-	for city in cities:
-	    tweet_list = tweet_to_cty_dict[city.name]
-	    for tweet in tweet_list:
-		total_tweet_count += 1.0
+	total_tweet_count = float(us_tweets_query().filter(Tweet.city!=None).count())
 	d = Container(key=key, value=json.dumps(total_tweet_count))
 	model.session.add(d)
 	model.session.commit()
@@ -240,70 +404,32 @@ def prob_word_given_city(city, word):
     prob_w_given_c = (number_times_word_in_city +1.0)/(count_city_word_total + leng_total_corpus)
     return float(prob_w_given_c)
 
-#Memcaches number of unique word entries in a city corpus 
+#Number of unique word entries in a city corpus 
 def find_leng_city_corpus(city):
-    key = 'city_corpus_length' + city.name.replace(" ", "_")
-    city_corpus_length = cache.get(key)
-    if not city_corpus_length:
-	print 'Missed the cache Recomputing city_corpus_length'
-	cty_corpus_dict = city_corpus_dict()
-	dic = cty_corpus_dict[city.name]
-	city_corpus_length = len(dic.keys())
-	cache.set(key, city_corpus_length, timeout=5*60)
-    return city_corpus_length
+    return stats.get_stats().city_vocabulary_sizes[city.name]
 
 #Returns list of unique word entries in entire corpus
 def total_corpus_list():
-    length = 0.0
-    uniques = set()
-    cty_corpus_dict = city_corpus_dict()
-    for city in cities:
-	dic = cty_corpus_dict[city.name]
-	uniques |= set(dic.keys())
-    uniques = list(uniques)
-    return uniques
+    ensure_city_word_counts()
+    return corpus.all_words()
 
 
-#Memcaches number of unique word entries in total
+#Number of unique word entries in total
 def find_leng_total_corpus():
-    key = 'total_corpus_length'
-    total_corpus_length = cache.get(key)
-    if not total_corpus_length:
-	length = 0.0
-	uniques = set()
-	cty_corpus_dict = city_corpus_dict()
-	for city in cities:
-	    dic = cty_corpus_dict[city.name]
-	    uniques |= set(dic.keys())
-	cache.set(key, total_corpus_length, timeout=5*60)
-    return len(uniques)
+    return stats.get_stats().vocabulary_size
 	    
 #P(City)- We will assume that the likelihood correlates to how well represented the city is in the whole sample size
 def prob_city_overall(city):
-    number_city_tweets = create_region_tweet_count(city)
-    number_total_tweets = create_tweet_total_count()
-    p = number_city_tweets/number_total_tweets
-    return float(p)
+    return float(stats.get_stats().priors[city.name])
 
 #P(Not-City) = 1 - P(City)- Not called in relative formula
 #def prob_not_city(city):
 #    p = float(1.0 - prob_city_overall(city))
 #    return float(p) 
 
-#Memcaches number of times a word occurs in a city's corpus 
+#Number of times a word occurs in a city's corpus 
 def find_count_of_word_in_city(city, word):
-    #key = word+city.name.replace(" ", "_")
-    #count_of_word = cache.get(key)
-    #if not count_of_word:
-#	print "Missed the cache of count_of_word: %s" % key
-    cty_corpus_dict = city_corpus_dict()
-    dic = cty_corpus_dict[city.name]
-    count_of_word = dic.get(word, 0)
-#	count_of_word = dic.get(word, 0)
-#	try:
-#	    cache.set(key, count_of_word, timeout=5*60)
-#	except Exception:
-#	    pass
+    count_of_word = stats.get_stats().city_word_counts[city.name].get(corpus.to_unicode(word), 0)
     return float(count_of_word) 
 
 
@@ -314,7 +440,7 @@ def find_count_of_word_total(word):
     for city in cities:
 	tweet_list = tweet_to_city_dict[city.name]
 	for tweet in tweet_list:
-	    for item in tweet.text.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split():
+	    for item in tokenizer.tokenize(tweet.text):
 		if item==word:
 		    count+=1.0
     return float(count) 
@@ -342,50 +468,43 @@ def find_count_of_word_total(word):
 #    return float(prob_city_given_word) 
 
 
+#Union of the top TOP_FEATURE_COUNT features of every city- only these words are scored when classifying.
+#Precomputed by feature_selection.store_top_features and loaded once per worker and model version
+TOP_FEATURE_COUNT = 500
+TOP_FEATURES_KEY = 'top_features'
+def load_top_features():
+    container = session.query(Container).filter(Container.key==TOP_FEATURES_KEY).first()
+    if container:
+	features = frozenset(json.loads(container.value))
+    else:
+	print 'Couldn\'t get top features from database'
+	features = set()
+	for city in cities:
+	    city_features = model.session.query(Features).filter(Features.city_name==city.name).first()
+	    features |= set(city_features.list_of_features()[:TOP_FEATURE_COUNT])
+	features = frozenset(features)
+    return features
+
+TOP_FEATURES = stats.VersionedCache(load_top_features)
 def get_set_of_words():
-    features = set()
-    for city in cities:
-	city_features = model.session.query(Features).filter(Features.city_name==city.name).first()
-	city_features = city_features.city_features
-	city_features = json.loads(city_features)
-	city_features = city_features[:500]
-	features = features.union(set(city_features))
-    return features 
+    return TOP_FEATURES.get()
 
 #final formula for Prob(City/Tweet)-- puting together components from two function below this.p = (p1p2..pn)/(p1p2..pn+(1-p1)(1-p2)..(1-pn)) 
 #CHANGED to log(P(City)+log(P(w1/City)+log(P(w2/City))...
 #Improved text classification by only classifying words that appear in top 200 words within any region 
+#Scored against the compiled in-memory model (see classifier.py) so classifying a tweet makes no db queries
 def prob_tweet_from_city(city,tweet_string):
-    total_start = datetime.datetime.now()
-    stop_words = {'if':1,'between':1, 'about':1, 'even':1, 'its':1, 'on':1, 'that':1, 'in':1,'it':1, 'every':1,'got':1, 'where':1,'maybe':1, 'came':1, 'along':1,'got':1, 'did':1,'every':1, 'how':1,'his':1, 'took':1, 'could':1, 'would':1, 'will':1, 'at':1, 'should':1, 'can':1, 'we':1, 'us':1, 'as':1,'at':1, 'him':1,'to':1,'sometimes':1, 'you':1, 'were':1, 'i':1, 'my':1, 'her':1, 'he':1,'me':1, 'this':1, 'was':1, 'had':1,'all':1, 'the':1, 'but':1, 'or':1, 'and':1,'there':1, 'it':1, 'is':1, 'then':1, 'a':1, 'an':1, 'be':1, 'for':1, 'of':1, 'what':1, 'when':1, 'why':1, 'where':1, 'are':1, 'am':1, 'because':1, 'they':1,'she':1, 'he':1}
-    x = 0
-    num_queries = 0
-    total_time = datetime.timedelta()
-    tweet_words = tweet_string.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split()
-    top_features = get_set_of_words()
-    for word in tweet_words:
-#	if word not in stop_words:
-	if word in top_features and word not in stop_words:
-	    num_queries += 1
-	    start = datetime.datetime.now()
-	    word_instance  = session.query(Word).filter(Word.word==word).filter( Word.city==city.name).first()
-	    end = datetime.datetime.now()
-	    time = (end - start)
-	    total_time += time
-	    if word_instance:
-		prob_w_given_c = word_instance.probability
-		x += math.log(prob_w_given_c)
-    prob_city_given_tweet_relative_to = math.log(prob_city_overall(city)) + x
-    total_end = datetime.datetime.now()
-    print 'It took %s to run %s queries' % (total_time, num_queries)
-    print 'It took %s to calculate %s' % ((total_end - total_start), city.name)
+    compiled_model = classifier.get_model()
+    prob_city_given_tweet_relative_to = compiled_model.score_city(city.name, tweet_string)
     return float(prob_city_given_tweet_relative_to)
 
 #Creates a list of city, probability-tweet-from-city pairs. Relative probabilities for each city
+#All nine cities are scored in one pass over the compiled model instead of once per city
 def create_list_of_probs(tweet_string):
+    scores = classifier.get_model().scores(tweet_string)
     new_list = []
-    for city in cities:
-	tu = (city, prob_tweet_from_city(city, tweet_string))
+    for i in range(0, len(cities)):
+	tu = (cities[i], float(scores[i]))
 	new_list.append(tu)
     return new_list
 
@@ -396,6 +515,15 @@ def create_ranking(tweet_string):
     x = probs
     return x
 
+#Rankings for a whole batch of tweets at once- same shape as create_ranking for every tweet. Used to re-score archived tweets offline
+def classify_many(tweet_strings):
+    scores = classifier.get_model().scores_many(tweet_strings)
+    order = np.argsort(-scores, axis=1, kind='mergesort')
+    rankings = []
+    for i in range(0, len(scores)):
+	rankings.append([(cities[j], float(scores[i][j])) for j in order[i]])
+    return rankings
+
 def main():
     pass
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+tweets = Table('tweets', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('screename', String(length=200), nullable=False),
+    Column('text', String(length=1000), nullable=False),
+    Column('longitude', Float(precision=6), nullable=False),
+    Column('latitude', Float(precision=6), nullable=False),
+    Column('created_at', DateTime),
+    Column('city', Integer),
+    Column('distance_km', Float(precision=6)),
+)
+
+ix_tweets_city = Index('ix_tweets_city', tweets.c.city)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['tweets'].columns['city'].create()
+    post_meta.tables['tweets'].columns['distance_km'].create()
+    ix_tweets_city.create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    ix_tweets_city.drop()
+    post_meta.tables['tweets'].columns['city'].drop()
+    post_meta.tables['tweets'].columns['distance_km'].drop()
@@ -0,0 +1,32 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+model_stats = Table('model_stats', post_meta,
+    Column('city_id', Integer, primary_key=True, nullable=False, autoincrement=False),
+    Column('city_name', String(length=64), nullable=False),
+    Column('version', Integer, nullable=False),
+    Column('tweet_count', Integer, nullable=False),
+    Column('token_count', Integer, nullable=False),
+    Column('vocabulary_size', Integer, nullable=False),
+    Column('log_prior', Float, nullable=False),
+    Column('smoothing_denominator', Float, nullable=False),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['model_stats'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['model_stats'].drop()
@@ -0,0 +1,29 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+city_word_counts = Table('city_word_counts', post_meta,
+    Column('city_id', Integer, primary_key=True, nullable=False, autoincrement=False),
+    Column('word_id', Integer, primary_key=True, nullable=False, autoincrement=False),
+    Column('term_count', Integer, nullable=False),
+    Column('doc_count', Integer, nullable=False),
+    Column('feature_rank', Integer),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['city_word_counts'].columns['feature_rank'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['city_word_counts'].columns['feature_rank'].drop()
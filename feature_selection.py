@@ -3,32 +3,30 @@ import model
 from math import sqrt, log
 from operator import itemgetter
 import math
-import operator
 import model
 import haversine
-import string
+import tokenizer
+import corpus
+import stats
 from data import cities, los_angeles, boston, chicago, houston, atlanta, new_york, seattle, miami, san_francisco
 import data 
 import json
+import config
+import numpy as np
+import artifact
+import classifier
 # Main Mutual Information equation derived from http://nlp.stanford.edu/IR-book/html/htmledition/mutual-information-1.html
 from app import db
 session = db.session
 
 #Helper function to get list of unique words
 def get_corpus():
-    corpus = {}
-    city_to_dict_of_words_to_counts = data.city_corpus_dict()
-    for city in cities:
-	city_corpus = city_to_dict_of_words_to_counts[city.name]
-	for word in city_corpus.keys():
-	    corpus[word] = True
-    return corpus.keys()
+    return data.total_corpus_list()
 
 #N11: Tweets containing word and in city; N10: Tweets containing word and not in city; N00: Tweets not containing word, and not in city; N01: Tweets not containing wird and in the city.
 def get_tweet_word_counts(word, city):
-    city_tweet_corpus_dict = data.city_tweet_corpus_dict()
-    word_tweet_count_dic = city_tweet_corpus_dict[city.name]
-    N11 = word_tweet_count_dic.get(word,0)
+    word_counts = data.word_counts_by_city(word)
+    N11 = word_counts.get(city.name, (0, 0))[1]
     
     Ndot_1 = data.create_region_tweet_count(city)
     N01 = Ndot_1 - N11
@@ -36,8 +34,7 @@ def get_tweet_word_counts(word, city):
     Ndot_0 = N - Ndot_1
     N1_dot = 0 
     for c in cities:
-	tweet_corpus_d = city_tweet_corpus_dict[c.name]
-	N1_dot += tweet_corpus_d.get(word, 0)
+	N1_dot += word_counts.get(c.name, (0, 0))[1]
     N10 = N1_dot - N11 
     N00 = Ndot_0 - N10
     N0_dot = N00 + N01 
@@ -52,40 +49,96 @@ def get_hardcoded_features(city):
     features = features[:30]
     return features 
 
-#Stores ranked list of words in the database 
-def populate_db_with_features(city):
-    feature_list =  rank(city)
-       
-    features = json.dumps(feature_list)
-    print features
+#Stores one city's ranked features. Pass rankings (from rank_all) to store several cities out of one ranking pass
+def populate_db_with_features(city, rankings=None):
+    if rankings is None:
+	rankings = rank_all()
+    store_city_features(city, rankings[city.name])
+    model.session.commit()
+    store_top_features()
+
+#The top config.FEATURE_LIMIT of feature_list- (word, score) pairs, best first- go in the features table with their scores and the
+#position of every word in city_word_counts, for the explanations. Not committed
+def store_city_features(city, feature_list):
+    corpus.replace_feature_ranks(city.id, [word for word, score in feature_list])
+    features = json.dumps(feature_list[:config.FEATURE_LIMIT])
     feature_instance = model.session.query(Features).filter(Features.city_name==city.name).first()
     if feature_instance:
 	feature_instance.city_features=features
-	model.session.add(feature_instance)
-	model.session.commit()
     else:
-	new_features = Features(city_features=features, city_name=city.name)
-	model.session.add(new_features)
-	model.session.commit()
-
-def rank(city):
-    city_corpus = data.city_corpus_dict()
-    word_dict = city_corpus[city.name]
-    feature_weight_list = []
-    count = 0
-    for word in word_dict.keys():
-	wf = get_tweet_word_counts(word, city)
-	score = mutual_info_score(wf['N11'], wf['N10'], wf['N01'], wf['N00'])
-	feature_weight_list.append((word, score))
-	count += 1
-    feature_weight_list.sort(key=operator.itemgetter(1), reverse=True)
-    winner_list = []
-    feature_word_list = [t[0] for t in feature_weight_list]
-    stop_words = {'every':1, 'got':1,'through':1,'our':1,'especially':1,'about':1,'before':1, 'between':1, 'by':1, 'during':1, 'except':1, 'for':1, 'with':1, 'without':1,'in':1, 'how':1,'his':1, 'took':1, 'could':1, 'would':1, 'will':1, 'at':1, 'should':1, 'can':1, 'we':1, 'us':1, 'as':1,'at':1, 'him':1,'to':1,'sometimes':1, 'you':1, 'were':1, 'i':1, 'my':1, 'her':1, 'he':1,'me':1, 'this':1, 'was':1, 'had':1,'all':1, 'the':1, 'but':1, 'or':1, 'and':1,'there':1, 'it':1, 'is':1, 'then':1, 'a':1, 'an':1, 'be':1, 'for':1, 'of':1, 'what':1, 'when':1, 'why':1, 'where':1, 'are':1, 'am':1, 'because':1, 'they':1}
-    for word in feature_word_list:
-	if word not in stop_words:
-	    winner_list.append(word)
-    return winner_list 
+	feature_instance = Features(city_features=features, city_name=city.name)
+    model.session.add(feature_instance)
+
+#Stores the union of every city's top features in one row, so serving reads a single small list instead of every city's ranked features.
+#Refreshed each time a city's features are repopulated
+def store_top_features():
+    top_features = set()
+    for feature_instance in model.session.query(Features):
+	top_features |= set(feature_instance.list_of_features()[:data.TOP_FEATURE_COUNT])
+    value = json.dumps(sorted(top_features))
+    container = model.session.query(Container).filter(Container.key==data.TOP_FEATURES_KEY).first()
+    if container:
+	container.value = value
+    else:
+	container = Container(key=data.TOP_FEATURES_KEY, value=value)
+    model.session.add(container)
+    model.session.commit()
+
+#Stores every city's ranked features, all ranked in one pass over the corpus
+def populate_db_with_all_features():
+    rankings = rank_all()
+    for city in cities:
+	store_city_features(city, rankings[city.name])
+    model.session.commit()
+    store_top_features()
+
+#N11, N10, N01, N00 for every (word, city) pair as (words x cities) arrays- the contingency table of get_tweet_word_counts for the
+#whole vocabulary at once, from the tweet counts of the corpus
+def contingency_tables():
+    words, N11 = corpus.doc_count_matrix([city.id for city in cities])
+    Ndot_1 = np.array([data.create_region_tweet_count(city) for city in cities], dtype=float)
+    N = float(data.create_tweet_total_count())
+    N1_dot = N11.sum(axis=1)[:, np.newaxis]
+    N10 = N1_dot - N11
+    N01 = Ndot_1 - N11
+    N00 = (N - Ndot_1) - N10
+    return words, N11, N10, N01, N00
+
+#mutual_info_score of every cell at once. A term whose count is 0 contributes 0 and words that never occur in a city score -inf
+def mutual_info_scores(N11, N10, N01, N00):
+    N1_dot = N11 + N10
+    N0_dot = N01 + N00
+    Ndot_1 = N11 + N01
+    Ndot_0 = N10 + N00
+    N = N10 + N11 + N01 + N00
+    with np.errstate(divide='ignore', invalid='ignore'):
+	scores = (mutual_info_term(N11, N, N1_dot, Ndot_1) + mutual_info_term(N01, N, N0_dot, Ndot_1) +
+	    mutual_info_term(N10, N, N1_dot, Ndot_0) + mutual_info_term(N00, N, N0_dot, Ndot_0))
+    scores[N11 <= 0] = float("-inf")
+    return scores
+
+def mutual_info_term(Nxy, N, Nx_dot, Ndot_y):
+    return np.where(Nxy > 0, (Nxy/N) * np.log2((N*Nxy)/(Nx_dot*Ndot_y)), 0.0)
+
+#Never stored as features
+STOP_WORDS = frozenset(['every', 'got', 'through', 'our', 'especially', 'about', 'before', 'between', 'by', 'during', 'except', 'for', 'with', 'without', 'in', 'how', 'his', 'took', 'could', 'would', 'will', 'at', 'should', 'can', 'we', 'us', 'as', 'him', 'to', 'sometimes', 'you', 'were', 'i', 'my', 'her', 'he', 'me', 'this', 'was', 'had', 'all', 'the', 'but', 'or', 'and', 'there', 'it', 'is', 'then', 'a', 'an', 'be', 'of', 'what', 'when', 'why', 'where', 'are', 'am', 'because', 'they'])
+
+#Maps city name to its ranked list of (word, score) features: every word that occurs in the city, best mutual information
+#score first, ties in vocabulary order, stop words removed
+def rank_all():
+    words, N11, N10, N01, N00 = contingency_tables()
+    scores = mutual_info_scores(N11, N10, N01, N00)
+    stop_words = np.array([word in STOP_WORDS for word in words], dtype=bool)
+    rankings = {}
+    for j, city in enumerate(cities):
+	candidates = np.flatnonzero((N11[:, j] > 0) & ~stop_words)
+	city_scores = scores[candidates, j]
+	order = np.lexsort((candidates, -city_scores))
+	rankings[city.name] = [(words[candidates[i]], float(city_scores[i])) for i in order]
+    return rankings
+
+def rank(city, limit=config.FEATURE_LIMIT):
+    return [word for word, score in rank_all()[city.name][:limit]]
 
 def mutual_info_score(N11, N10, N01, N00):
     N1_dot = N11 + N10
@@ -105,23 +158,85 @@ def mutual_info_score(N11, N10, N01, N00):
 	first_log = 0
     return first_log + (N01/N) * math.log((N*N01)/(N0_dot*Ndot_1), 2) + third_log + (N00/N) * math.log((N*N00)/(N0_dot*Ndot_0), 2)
 
+#Inverted index of every city's full feature ranking: utf-8 word -> {city name: (rank, score)}, rank counting from 1. Ranks are read
+#from a (words x cities) array of positions, -1 where the word isn't ranked, and scores are only known for the stored features.
+#Supports the dict lookup tweet_feature_ranks uses
+class FeatureIndex(object):
+    def __init__(self, city_names, vocabulary, ranks, scores):
+	self.city_names = city_names
+	self.vocabulary = vocabulary
+	self.ranks = ranks
+	self.scores = scores
+
+    def get(self, word, default=None):
+	word = artifact.to_utf8(word)
+	word_id = self.vocabulary.get(word)
+	if word_id is None:
+	    return default
+	word_scores = self.scores.get(word, {})
+	city_ranks = {}
+	for j in np.flatnonzero(self.ranks[word_id] >= 0):
+	    city_name = self.city_names[j]
+	    city_ranks[city_name] = (int(self.ranks[word_id, j]) + 1, word_scores.get(city_name))
+	return city_ranks
+
+#(words x cities) feature_rank positions with rows in the order of vocabulary (utf-8 word -> row), -1 where the word isn't ranked.
+#Tables ranked before city_word_counts kept the full ranking only have the stored features to go on
+def feature_rank_array(vocabulary):
+    ranks = np.empty((len(vocabulary), len(cities)), dtype=np.int32)
+    ranks.fill(-1)
+    city_index = dict((city.id, j) for j, city in enumerate(cities))
+    rows = corpus.feature_ranks()
+    if not rows:
+	city_ids = dict((city.name, city.id) for city in cities)
+	for feature_instance in model.session.query(Features):
+	    city_id = city_ids[feature_instance.city_name]
+	    rows.extend((feature, city_id, rank) for rank, feature in enumerate(feature_instance.list_of_features()))
+    for word, city_id, rank in rows:
+	word_id = vocabulary.get(artifact.to_utf8(word))
+	if word_id is not None:
+	    ranks[word_id, city_index[city_id]] = rank
+    return ranks
+
+#Built once per worker and model version: the ranks come straight from the mapped artifact when there is one, otherwise they are
+#read from the db into an array over the classification model's vocabulary. Scores come from the stored features in one query
+def load_feature_index():
+    scores = {}
+    for feature_instance in model.session.query(Features):
+	for feature, score in feature_instance.scored_features():
+	    scores.setdefault(feature.encode("utf-8"), {})[feature_instance.city_name] = score
+    model_artifact = artifact.open_artifact(config.MODEL_ARTIFACT, stats.current_model_version())
+    if model_artifact:
+	return FeatureIndex(model_artifact.city_names, model_artifact.vocabulary, model_artifact.arrays['feature_ranks'], scores)
+    compiled_model = classifier.get_model()
+    return FeatureIndex(compiled_model.city_names, compiled_model.vocabulary, feature_rank_array(compiled_model.vocabulary), scores)
+
+FEATURE_INDEX = stats.VersionedCache(load_feature_index)
+def get_feature_index():
+    return FEATURE_INDEX.get()
+
+#Maps city name to the list of (word, rank) for the words of a tweet that are features of that city, best ranked first.
+#One index lookup per distinct word of the tweet
+def tweet_feature_ranks(tweet_string):
+    feature_index = get_feature_index()
+    included_features = dict((city.name, []) for city in cities)
+    for word in set(tokenizer.tokenize(tweet_string)):
+	for city_name, (rank, score) in feature_index.get(word, {}).items():
+	    included_features[city_name].append((word, rank))
+    for city_features in included_features.values():
+	city_features.sort(key=itemgetter(1))
+    return included_features
+
 #Returns list of user words and their position in the ranked list of features features
 def get_city_included_features(city, tweet_string):
-    tweet_words = tweet_string.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split()
-    uniques = set(tweet_words)
-    tweet_words = list(uniques)
-    features = model.session.query(Features).filter(Features.city_name==city.name).first()
-    features = features.city_features
-    features = json.loads(features)
-    included_features = []
-    for index, feature in enumerate(features):
-	if feature in tweet_words:
-	    included_features.append((feature.encode("utf-8"), index+1))
-    return included_features
+    return tweet_feature_ranks(tweet_string)[city.name]
 
-#called in Controller to display ranking for words in a user's tweet
-def included_feature_strings(city, tweet_string):
-    features = get_city_included_features(city, tweet_string)
+#called in Controller to display ranking for words in a user's tweet. Pass feature_ranks (from tweet_feature_ranks) when
+#building the strings for every city, so the tweet is only looked up once
+def included_feature_strings(city, tweet_string, feature_ranks=None):
+    if feature_ranks is None:
+	feature_ranks = tweet_feature_ranks(tweet_string)
+    features = feature_ranks[city.name]
     feature_strings = []
     for feature in features:
 	word_feature = feature[0]  
@@ -132,10 +247,7 @@ def included_feature_strings(city, tweet_string):
         
 #Returns dictionary of each city and their corresponding included_features list, given a tweet
 def get_included_features_dict(tweet_string):
-    included_features_dict = {}
-    for city in cities:
-	included_features_dict[city.name] = get_city_included_features(city,tweet_string)
-    return included_features_dict
+    return tweet_feature_ranks(tweet_string)
 
 
 def main():
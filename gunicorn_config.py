@@ -0,0 +1,16 @@
+import os
+
+#Run with: gunicorn -c gunicorn_config.py twitter_map:app (see Procfile)
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+#Import the app in the master so the model is built once, before the workers are forked, and shared copy-on-write
+preload_app = True
+
+#Builds the serving model in the master. With preload_app twitter_map is already imported by now
+def on_starting(server):
+    import twitter_map
+    twitter_map.warm_up()
+
+#Each worker needs its own db connections and memcached sockets- the ones the master opened while warming up are dropped
+def post_fork(server, worker):
+    import twitter_map
+    twitter_map.after_fork()
@@ -0,0 +1,38 @@
+import math
+import numpy as np
+
+#Tweet counts per web map tile (the x/y/zoom tiles google maps uses) for each city, so the browser can draw a heatmap from a
+#few kilobytes instead of every tweet. Built with one 2d histogram per city and zoom level at training time
+ZOOM_LEVELS = (4, 6, 8, 10)
+#Only tiles inside the bounding box that data.us_tweets_query selects are counted
+MIN_LON, MAX_LON = -125.0, -65.0
+MIN_LAT, MAX_LAT = 25.0, 50.0
+
+#Fractional tile x and y of coordinates at a zoom level (spherical mercator). Tile (int(x), int(y)) contains the point
+def tile_coordinates(lons, lats, zoom):
+    n = 2 ** zoom
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    x = (lons + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / math.pi) / 2.0 * n
+    return x, y
+
+#First and last tile x and y covering the bounding box at a zoom level
+def tile_range(zoom):
+    x, y = tile_coordinates([MIN_LON, MAX_LON], [MAX_LAT, MIN_LAT], zoom)
+    return int(x[0]), int(x[1]), int(y[0]), int(y[1])
+
+#Maps city id to [[tile x, tile y, # of tweets], ...] for every non-empty tile at the zoom level
+def tile_counts(city_ids, lons, lats, zoom):
+    city_ids = np.asarray(city_ids)
+    x, y = tile_coordinates(lons, lats, zoom)
+    min_x, max_x, min_y, max_y = tile_range(zoom)
+    bins = [max_x - min_x + 1, max_y - min_y + 1]
+    bin_range = [[min_x, max_x + 1], [min_y, max_y + 1]]
+    counts = {}
+    for city_id in np.unique(city_ids):
+	in_city = city_ids == city_id
+	histogram, x_edges, y_edges = np.histogram2d(x[in_city], y[in_city], bins=bins, range=bin_range)
+	tiles_x, tiles_y = np.nonzero(histogram)
+	counts[int(city_id)] = [[int(min_x + i), int(min_y + j), int(histogram[i, j])] for i, j in zip(tiles_x, tiles_y)]
+    return counts
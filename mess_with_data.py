@@ -6,7 +6,7 @@ from math import sqrt, log
 import math
 import model
 from sklearn import feature_selection
-import string
+import tokenizer
 
 #global instances
 los_angeles = Los_Angeles()
@@ -84,7 +84,7 @@ def city_corpus_dict():
     for city in cities:
 	city_corpus_dict = {}
 	for tweet in tweet_to_city_dict[city]:
-	    tweet_text = tweet.text.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split()
+	    tweet_text = tokenizer.tokenize(tweet.text)
 	    for word in tweet_text:
 		if word not in city_corpus_dict:
 		    city_corpus_dict[word]=1
@@ -190,7 +190,7 @@ def find_count_of_word_in_city(city, word):
     tweet_list = tweet_to_cty_dict[city]
     count = 0.0
     for tweet in tweet_list:
-	for item in tweet.text.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split():
+	for item in tokenizer.tokenize(tweet.text):
 	    if item==word:
 		count+=1.0
     return float(count)
@@ -203,7 +203,7 @@ def find_count_of_word_total(word):
     for city in cities:
 	tweet_list = tweet_to_cty_dict[city]
 	for tweet in tweet_list:
-	    for item in tweet.text.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split():
+	    for item in tokenizer.tokenize(tweet.text):
 		if item==word:
 		    count+=1.0
     return float(count) 
@@ -237,7 +237,7 @@ def prob_city_given_word(city,word):
 #P(C/Tweet)
 #new formula to deal with underflow
 def prob_tweet_from_city(city,tweet_string):
-    tweet_words = tweet_string.encode("utf-8").lower().translate(string.maketrans("",""),string.punctuation).split()
+    tweet_words = tokenizer.tokenize(tweet_string)
     probs= [prob_city_given_word(city,word) for word in tweet_words]
     eta = sum([math.log(1.0-prob)-math.log(prob) for prob in probs]) 
     total_prob = 1.0/(1.0 + math.exp(eta))
@@ -274,9 +274,7 @@ def find_feature_label_list():
     for city in cities:
 	tweet_object_list = d[city]
 	for tweet in tweet_object_list:
-	    tweet_string = tweet.text.encode("utf-8").lower()
-	    no_punc_string = tweet_string.translate(string.maketrans("",""),string.punctuation)
-	    word_list = no_punc_string.split()
+	    word_list = tokenizer.tokenize(tweet.text)
 	    for word in word_list:
 		if word not in corpus_feature_label_list:
 		    corpus_feature_label_list.append(word) 
@@ -23,6 +23,36 @@ class Container(db.Model):
     value = Column(String(2000000), nullable=False)
 
 
+#Every distinct word in the corpus, referenced by id from city_word_counts. ids are assigned by corpus.py rather than a sequence
+class Vocabulary(db.Model):
+    __tablename__ = "vocabulary"
+    id = Column(Integer, primary_key = True, autoincrement = False)
+    word = Column(String(500), nullable = False, unique = True)
+
+#Counts for one word in one city region: term_count is the number of times it occurs in the city's tweets and doc_count
+#the number of the city's tweets it occurs in. Keyed (city_id, word_id) for a city's counts, with word_id indexed for a word's counts across cities.
+#feature_rank is the word's position in the city's full mutual information ranking (0 is the best feature), null if it isn't ranked
+class CityWordCount(db.Model):
+    __tablename__ = "city_word_counts"
+    city_id = Column(Integer, primary_key = True, autoincrement = False)
+    word_id = Column(Integer, primary_key = True, autoincrement = False, index = True)
+    term_count = Column(Integer, nullable = False)
+    doc_count = Column(Integer, nullable = False)
+    feature_rank = Column(Integer)
+
+#Per-city statistics of the trained model, written by training.publish_model: the # of tweets and words in the city, its number of
+#distinct words, log P(City) and the smoothing denominator of P(W/City)- city word total + vocabulary size
+class ModelStats(db.Model):
+    __tablename__ = "model_stats"
+    city_id = Column(Integer, primary_key = True, autoincrement = False)
+    city_name = Column(String(64), nullable = False)
+    version = Column(Integer, nullable = False)
+    tweet_count = Column(Integer, nullable = False)
+    token_count = Column(Integer, nullable = False)
+    vocabulary_size = Column(Integer, nullable = False)
+    log_prior = Column(Float, nullable = False)
+    smoothing_denominator = Column(Float, nullable = False)
+
 class Word(db.Model):
     __tablename__ = "words"
     id = Column(Integer, primary_key = True) 
@@ -39,6 +69,10 @@ class Tweet(db.Model):
     longitude = Column(Float(precision=6), nullable = False)
     latitude = Column(Float(precision=6), nullable = False) 
     created_at = Column(DateTime , nullable = True)
+    #id of the closest major city region (None when none is within 150 miles) and the distance to that region's center.
+    #Filled in once when the tweet is loaded so per-city queries are an index lookup
+    city = Column(Integer, nullable = True, index = True)
+    distance_km = Column(Float(precision=6), nullable = True)
 
     def __repr__(self):
         return 'Tweet: %d %s %s %s %f %f' % (
@@ -57,16 +91,22 @@ class Tweet(db.Model):
 
     @classmethod  
     def create_from_dict(cls, dict):
-        tweet = Tweet()
-	tweet.screename = dict.get('screen_name')
-	tweet.text = dict.get('text')
-	tweet.created_at = datetime.strptime(dict.get('created_at'), '%Y-%m-%dT%H:%M:%S')
+        tweet = Tweet(**cls.row_from_dict(dict))
+	return tweet
+
+    #Column values for a tweet dict from the streaming api, for bulk inserts that skip building Tweet objects
+    @classmethod
+    def row_from_dict(cls, dict):
+	row = {}
+	row['screename'] = dict.get('screen_name')
+	row['text'] = dict.get('text')
+	row['created_at'] = datetime.strptime(dict.get('created_at'), '%Y-%m-%dT%H:%M:%S')
 	#tweet.created_at = datetime.strptime(dict.get('created_at'), 'datetime.datetime(%Y, %m, %d, %H, %M, %S)')
 	geo_location = dict.get('coordinates')
 	coordinate_list = geo_location.get('coordinates')
-	tweet.longitude = coordinate_list[0]
-	tweet.latitude = coordinate_list[1]
-	return tweet
+	row['longitude'] = coordinate_list[0]
+	row['latitude'] = coordinate_list[1]
+	return row
 
 class Features(db.Model):
     __tablename__ = 'features'
@@ -75,16 +115,23 @@ class Features(db.Model):
     city_features = Column(String(1000000), nullable=False)
     city_name = Column(String(128), nullable=False) 
 
-    def list_of_features(self):
+    #Stored as [[word, mutual information score], ...], best first. Rows written before scores were kept are a plain list of words
+    def scored_features(self):
 	features = json.loads(self.city_features)
+	return [feature if isinstance(feature, list) else [feature, None] for feature in features]
+
+    def list_of_features(self):
+	features = [feature[0] for feature in self.scored_features()]
 	return features 
 
+#Major city regions. id is the region id stored with tweets, numbered in the order of data.cities
 class Los_Angeles():
     def __init__(self):
 	#los_angeles = Los_Angeles()
 	self.lon = -118.2436
 	self.lat = 34.0522
 	self.name = 'Los Angeles'
+	self.id = 1
 
 class San_Francisco():
     def __init__(self):
@@ -92,12 +139,14 @@ class San_Francisco():
 	self.lon = -122.416534
 	self.lat = 37.781569
 	self.name = 'San Francisco'
+	self.id = 2
 
 class Houston():
     def __init__(self):
 	self.lon = -95.369
 	self.lat = 29.760
 	self.name = 'Houston'
+	self.id = 3
 	#houston = Houston()
 
 class Atlanta():
@@ -105,6 +154,7 @@ class Atlanta():
 	self.lon = -84.3879
 	self.lat = 33.749
 	self.name = 'Atlanta'
+	self.id = 5
 	#atlanta = Atlanta()
 
 class New_York():
@@ -112,6 +162,7 @@ class New_York():
 	self.lon = -73.951721
 	self.lat = 40.703546
 	self.name = 'New York'
+	self.id = 6
 	#new_york = New York()
 
 class Chicago():
@@ -119,6 +170,7 @@ class Chicago():
 	self.lon = -87.6298
 	self.lat = 41.878
 	self.name= 'Chicago'
+	self.id = 7
 	#chicago = Chicago()
 
 class Miami(): 
@@ -126,6 +178,7 @@ class Miami():
 	self.lon = -80.2264
 	self.lat = 25.7889
 	self.name = 'Miami'
+	self.id = 4
 	#miami = Miami()
 
 class Seattle():
@@ -133,12 +186,14 @@ class Seattle():
 	self.lon= -122.33
 	self.lat=47.609
 	self.name='Seattle'
+	self.id = 8
 
 class Boston():
     def __init__(self):
 	self.lon = -71.0603
 	self.lat = 42.3583
 	self.name = 'Boston'
+	self.id = 9
 
     
 def create_db():
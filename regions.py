@@ -0,0 +1,45 @@
+import numpy as np
+
+#Same earth radius as haversine.py so distances agree with the scalar version
+EARTH_RADIUS_KM = 6367.0
+#Tweets further than 150 miles/240km from every region center don't belong to any region
+MAX_DISTANCE_KM = 240.0
+#Region id given to tweets outside every region
+NO_REGION = 0
+#Tweets are assigned this many at a time to bound the size of the (tweets x regions) distance matrix
+CHUNK_SIZE = 100000
+
+#Assigns tweets to the nearest region center for whole arrays of coordinates at once.
+#With only nine centers a ball tree or grid buys nothing over a vectorized haversine against every center- that is a single
+#(tweets x regions) array expression per chunk, so millions of tweets never go through a python loop.
+class RegionIndex(object):
+    def __init__(self, regions):
+	self.regions = regions
+	self.ids = np.array([region.id for region in regions])
+	self.lons = np.radians([region.lon for region in regions])
+	self.lats = np.radians([region.lat for region in regions])
+	self.cos_lats = np.cos(self.lats)
+
+    #(tweets x regions) matrix of haversine distances in km
+    def distances(self, lons, lats):
+	lons = np.radians(np.asarray(lons, dtype=np.float64))[:, np.newaxis]
+	lats = np.radians(np.asarray(lats, dtype=np.float64))[:, np.newaxis]
+	dlon = self.lons - lons
+	dlat = self.lats - lats
+	a = np.sin(dlat/2)**2 + np.cos(lats) * self.cos_lats * np.sin(dlon/2)**2
+	return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    #Returns (region ids, distances in km to the nearest center). The id is NO_REGION where the nearest center is too far away
+    def assign(self, lons, lats, max_distance=MAX_DISTANCE_KM):
+	lons = np.asarray(lons, dtype=np.float64)
+	lats = np.asarray(lats, dtype=np.float64)
+	region_ids = np.empty(len(lons), dtype=self.ids.dtype)
+	nearest_distances = np.empty(len(lons))
+	for start in range(0, len(lons), CHUNK_SIZE):
+	    end = start + CHUNK_SIZE
+	    distances = self.distances(lons[start:end], lats[start:end])
+	    nearest = np.argmin(distances, axis=1)
+	    nearest_distance = distances[np.arange(len(nearest)), nearest]
+	    region_ids[start:end] = np.where(nearest_distance < max_distance, self.ids[nearest], NO_REGION)
+	    nearest_distances[start:end] = nearest_distance
+	return region_ids, nearest_distances
@@ -1,16 +1,127 @@
 import model
 import sqlalchemy.exc
 import json 
+import os
+import time
+from app import db
+from sqlalchemy import bindparam, select
+import data
+from config import basedir
 
-def load_tweet_data(session):
-    in_file = open("seed_data/seeded_files/tweet_data_json_18.txt")
-    input_text = in_file.read()
-    list_of_dicts = json.loads(input_text)
-    for dict in list_of_dicts:
-	tweet = model.Tweet.create_from_dict(dict)
-	session.add(tweet)
-	session.commit()
+SEED_DIR = os.path.join(basedir, "seed_data", "seeded_files")
+#Rows per executemany- each batch is one transaction
+BATCH_SIZE = 5000
+READ_SIZE = 1 << 16
+
+#Yields the tweet dicts in a seeded file one at a time instead of json.loads-ing the whole file. Works for the files holding
+#one json list as well as for the back-to-back objects get_tweets.py appends
+def stream_tweet_dicts(path):
+    decoder = json.JSONDecoder()
+    in_file = open(path)
+    buf = ""
+    eof = False
+    while not eof:
+	chunk = in_file.read(READ_SIZE)
+	eof = not chunk
+	buf += chunk
+	pos = 0
+	while True:
+	    while pos < len(buf) and buf[pos] in "[], \t\r\n":
+		pos += 1
+	    if pos == len(buf):
+		break
+	    try:
+		dict, pos = decoder.raw_decode(buf, pos)
+	    except ValueError:
+		if eof:
+		    raise
+		break
+	    yield dict
+	buf = buf[pos:]
+    in_file.close()
+
+#Streams tweets into the tweets table BATCH_SIZE rows at a time with one executemany per batch. Returns the number of rows
+def load_tweet_data(path):
+    table = model.Tweet.__table__
+    rows = 0
+    batch = []
+    for dict in stream_tweet_dicts(path):
+	batch.append(model.Tweet.row_from_dict(dict))
+	if len(batch) == BATCH_SIZE:
+	    insert_batch(table, batch)
+	    rows += len(batch)
+	    batch = []
+    if batch:
+	insert_batch(table, batch)
+	rows += len(batch)
+    return rows
+
+#Fills in the city region and distance of every row so they never have to be recomputed from the coordinates
+def add_cities(batch):
+    lons = [row['longitude'] for row in batch]
+    lats = [row['latitude'] for row in batch]
+    city_ids, distances = data.assign_cities(lons, lats)
+    for i in range(0, len(batch)):
+	batch[i]['city'] = city_ids[i]
+	batch[i]['distance_km'] = distances[i]
+
+def insert_batch(table, batch):
+    add_cities(batch)
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    try:
+	connection.execute(table.insert(), batch)
+	transaction.commit()
+    except:
+	transaction.rollback()
+	raise
+    finally:
+	connection.close()
+
+#Loads every file in seed_data/seeded_files and reports rows per second as it goes
+def load_all_tweet_data(seed_dir=SEED_DIR):
+    total_rows = 0
+    total_start = time.time()
+    for filename in sorted(os.listdir(seed_dir)):
+	if not filename.endswith(".txt"):
+	    continue
+	start = time.time()
+	rows = load_tweet_data(os.path.join(seed_dir, filename))
+	elapsed = time.time() - start
+	total_rows += rows
+	print "%s: %d rows in %.1fs (%.0f rows/s)" % (filename, rows, elapsed, rows/max(elapsed, 1e-6))
+    elapsed = time.time() - total_start
+    print "loaded %d rows in %.1fs (%.0f rows/s)" % (total_rows, elapsed, total_rows/max(elapsed, 1e-6))
+    return total_rows
 	
+#Backfills tweets.city and tweets.distance_km for tweets loaded before those columns existed, BATCH_SIZE rows per executemany
+def assign_cities_to_tweets():
+    table = model.Tweet.__table__
+    update = table.update().where(table.c.id==bindparam('tweet_id')).values(city=bindparam('city'), distance_km=bindparam('distance_km'))
+    rows = 0
+    while True:
+	batch = db.engine.execute(select([table.c.id, table.c.longitude, table.c.latitude]).where(table.c.distance_km==None).limit(BATCH_SIZE)).fetchall()
+	if not batch:
+	    break
+	city_ids, distances = data.assign_cities([row.longitude for row in batch], [row.latitude for row in batch])
+	params = []
+	for i in range(0, len(batch)):
+	    params.append({'tweet_id': batch[i].id, 'city': city_ids[i], 'distance_km': distances[i]})
+	connection = db.engine.connect()
+	transaction = connection.begin()
+	try:
+	    connection.execute(update, params)
+	    transaction.commit()
+	except:
+	    transaction.rollback()
+	    raise
+	finally:
+	    connection.close()
+	rows += len(batch)
+    if rows:
+	print "assigned cities to %d tweets" % rows
+    return rows
+
 def load_tweet_from_python(session):
     f  = open("test.txt")
     text = f.read() 
@@ -20,10 +131,9 @@ def load_tweet_from_python(session):
 	session.add(tweet)
 	session.commit()
 
-def main(session):
-    load_tweet_data(session)
+def main():
+    load_all_tweet_data()
 	
 
 if __name__ == "__main__":
-    s = model.session
-    main(s)
+    main()
@@ -0,0 +1,177 @@
+from model import Container, ModelStats
+from app import db
+from collections import namedtuple
+import json
+import math
+import time
+import corpus
+import artifact
+import config
+
+session = db.session
+
+#Version of the trained model, stored in the containers table. Every rebuild or incremental update bumps it and each worker
+#reloads what it holds in memory the next time it notices the change. Versions only go up: a new one is never below the current
+#unix time, so a rebuild that empties the containers table still publishes a version no worker has loaded
+MODEL_VERSION_KEY = 'model_version'
+#Seconds between checks of the stored model version
+VERSION_CHECK_INTERVAL = 30
+
+def current_model_version():
+    container = session.query(Container).filter(Container.key==MODEL_VERSION_KEY).first()
+    if not container:
+	return 0
+    return json.loads(container.value)
+
+def next_model_version():
+    return max(current_model_version() + 1, int(time.time()))
+
+#Stores version, by default the next one, as the current model version
+def bump_model_version(version=None):
+    if version is None:
+	version = next_model_version()
+    container = session.query(Container).filter(Container.key==MODEL_VERSION_KEY).first()
+    if container:
+	container.value = json.dumps(version)
+    else:
+	container = Container(key=MODEL_VERSION_KEY, value=json.dumps(version))
+    session.add(container)
+    session.commit()
+    clear_caches()
+    return version
+
+def clear_caches():
+    for versioned_cache in VERSIONED_CACHES:
+	versioned_cache.clear()
+
+#Every VersionedCache in this process- cleared at once when this process bumps the version itself
+VERSIONED_CACHES = []
+
+#Holds something built from the db for the lifetime of the worker, rebuilding it once when the model version changes
+class VersionedCache(object):
+    def __init__(self, build):
+	self.build = build
+	self.value = None
+	self.version = None
+	self.checked_at = 0
+	VERSIONED_CACHES.append(self)
+
+    def get(self):
+	now = time.time()
+	if self.value is not None and now - self.checked_at < VERSION_CHECK_INTERVAL:
+	    return self.value
+	version = current_model_version()
+	self.checked_at = now
+	if self.value is None or version != self.version:
+	    self.value = self.build()
+	    self.version = version
+	return self.value
+
+    def clear(self):
+	self.value = None
+
+
+#Immutable snapshot of the corpus statistics the Naive Bayes formulas need. Dictionaries are keyed by city name:
+#city_word_counts maps word -> # of times it occurs in the city, city_word_totals the total word count of each city,
+#city_vocabulary_sizes the # of unique words in each city, priors P(City) and smoothing_denominators the denominator of P(W/City)
+CorpusStats = namedtuple('CorpusStats', ['version', 'city_word_counts', 'city_word_totals', 'city_vocabulary_sizes', 'vocabulary_size',
+    'city_tweet_counts', 'total_tweet_count', 'priors', 'log_priors', 'smoothing_denominators'])
+
+#Fills in the fields that follow from the others
+def make_stats(version, city_word_counts, city_word_totals, city_vocabulary_sizes, vocabulary_size, city_tweet_counts, total_tweet_count, priors):
+    log_priors = dict((city_name, math.log(prior)) for city_name, prior in priors.items())
+    smoothing_denominators = dict((city_name, total + vocabulary_size) for city_name, total in city_word_totals.items())
+    return CorpusStats(version, city_word_counts, city_word_totals, city_vocabulary_sizes, vocabulary_size, city_tweet_counts,
+	total_tweet_count, priors, log_priors, smoothing_denominators)
+
+#Statistics read from the corpus tables. data.py builds its own VersionedCaches when imported, so it is imported here rather
+#than at the top of the module
+def read_stats(version):
+    import data
+    cities = data.cities
+    data.ensure_city_word_counts()
+    term_counts = corpus.all_term_counts([city.id for city in cities])
+    city_word_counts = {}
+    city_word_totals = {}
+    city_vocabulary_sizes = {}
+    city_tweet_counts = {}
+    priors = {}
+    total_tweet_count = data.create_tweet_total_count()
+    for city in cities:
+	word_counts = term_counts[city.id]
+	city_word_counts[city.name] = word_counts
+	city_word_totals[city.name] = float(sum(word_counts.values()))
+	city_vocabulary_sizes[city.name] = len(word_counts)
+	city_tweet_counts[city.name] = data.create_region_tweet_count(city)
+	priors[city.name] = city_tweet_counts[city.name]/total_tweet_count
+    print "loaded corpus statistics from db"
+    return make_stats(version, city_word_counts, city_word_totals, city_vocabulary_sizes, corpus.vocabulary_size(),
+	city_tweet_counts, total_tweet_count, priors)
+
+#Word counts of one city read through the mapped artifact's vocabulary, for the same lookups as a {word: count} dict
+class MappedCounts(object):
+    def __init__(self, vocabulary, counts):
+	self.vocabulary = vocabulary
+	self.counts = counts
+
+    def get(self, word, default=None):
+	word_id = self.vocabulary.get(word)
+	if word_id is None or not self.counts[word_id]:
+	    return default
+	return int(self.counts[word_id])
+
+#Statistics out of the mapped model artifact- the totals are in its header and the word counts stay in the shared mapping
+def stats_from_artifact(model_artifact):
+    header = model_artifact.header
+    term_counts = model_artifact.arrays['term_counts']
+    city_word_counts = {}
+    for i, city_name in enumerate(model_artifact.city_names):
+	city_word_counts[city_name] = MappedCounts(model_artifact.vocabulary, term_counts[:, i])
+    return make_stats(model_artifact.version, city_word_counts, header['city_word_totals'], header['city_vocabulary_sizes'],
+	header['vocabulary_size'], header['city_tweet_counts'], header['total_tweet_count'], header['priors'])
+
+#Word counts of one city looked up in city_word_counts one word at a time. Only prob_word_given_city needs them and nothing on the
+#serving path calls that, so the db fallback doesn't load the whole corpus for them
+class CityCounts(object):
+    def __init__(self, city_id):
+	self.city_id = city_id
+
+    def get(self, word, default=None):
+	return corpus.city_term_counts(self.city_id, [word]).get(word, default)
+
+#Statistics out of the model_stats rows written for version, in one query. None if the rows aren't there
+def stats_from_model_stats(version):
+    rows = session.query(ModelStats).filter(ModelStats.version==version).all()
+    if not rows:
+	return None
+    city_word_counts = {}
+    city_word_totals = {}
+    city_vocabulary_sizes = {}
+    city_tweet_counts = {}
+    priors = {}
+    for row in rows:
+	city_word_counts[row.city_name] = CityCounts(row.city_id)
+	city_word_totals[row.city_name] = float(row.token_count)
+	city_vocabulary_sizes[row.city_name] = row.vocabulary_size
+	city_tweet_counts[row.city_name] = float(row.tweet_count)
+	priors[row.city_name] = math.exp(row.log_prior)
+    vocabulary_size = int(round(rows[0].smoothing_denominator - rows[0].token_count))
+    print "loaded corpus statistics from model_stats"
+    return make_stats(version, city_word_counts, city_word_totals, city_vocabulary_sizes, vocabulary_size, city_tweet_counts,
+	sum(city_tweet_counts.values()), priors)
+
+#From the mapped artifact if there is one for the current version, then the model_stats rows, then the corpus tables
+def load_stats():
+    version = current_model_version()
+    model_artifact = artifact.open_artifact(config.MODEL_ARTIFACT, version)
+    if model_artifact:
+	print "mapped corpus statistics from %s" % config.MODEL_ARTIFACT
+	return stats_from_artifact(model_artifact)
+    corpus_stats = stats_from_model_stats(version)
+    if corpus_stats:
+	return corpus_stats
+    return read_stats(version)
+
+STATS = VersionedCache(load_stats)
+def get_stats():
+    return STATS.get()
@@ -0,0 +1,45 @@
+import string
+
+#The one tokenizer shared by training and serving. Tweets are utf-8 encoded, lowercased, stripped of punctuation and split on whitespace.
+#The translation table is built once here instead of on every call.
+IDENTITY_TABLE = string.maketrans("", "")
+PUNCTUATION = string.punctuation
+
+#Joins a batch of tweets so the encode/lower/translate work happens in a single call- the separator survives translate()
+SEPARATOR = u"\0"
+
+#Lowercased tweet text with punctuation removed, not split into words
+def normalize(tweet_string):
+    return tweet_string.encode("utf-8").lower().translate(IDENTITY_TABLE, PUNCTUATION)
+
+#List of words in a tweet, repeated words included
+def tokenize(tweet_string):
+    return normalize(tweet_string).split()
+
+#Yields the vocabulary id of every word in a tweet that the vocabulary knows about
+def token_ids(tweet_string, vocabulary):
+    for word in tokenize(tweet_string):
+	word_id = vocabulary.get(word)
+	if word_id is not None:
+	    yield word_id
+
+#Bulk mode for corpus building- yields the word list of every tweet, in order. Tweets are normalized batch_size at a time
+#and words are interned so the same word from thousands of tweets is one string in the corpus dicts
+def tokenize_many(tweet_strings, batch_size=1000):
+    batch = []
+    for tweet_string in tweet_strings:
+	batch.append(tweet_string)
+	if len(batch) == batch_size:
+	    for words in _tokenize_batch(batch):
+		yield words
+	    batch = []
+    if batch:
+	for words in _tokenize_batch(batch):
+	    yield words
+
+def _tokenize_batch(batch):
+    normalized = normalize(SEPARATOR.join(batch)).split(SEPARATOR.encode("utf-8"))
+    if len(normalized) != len(batch):
+	#a tweet contained the separator itself, fall back to one tweet at a time
+	normalized = [normalize(tweet_string) for tweet_string in batch]
+    return [[intern(word) for word in text.split()] for text in normalized]
@@ -0,0 +1,189 @@
+from model import Word, Container, ModelStats, Tweet
+from app import db
+import json
+import numpy as np
+import data
+import tokenizer
+import corpus
+import stats
+import classifier
+import artifact
+import config
+import heatmap
+import feature_selection
+from data import cities
+
+session = db.session
+
+#Number of words looked up per IN (...) query when updating the words table
+WORD_CHUNK_SIZE = 500
+
+#Folds a batch of new tweets into the model without rebuilding it from the whole tweets table:
+#the per-city term counts, tweet counts and totals are updated in place and only the words table rows whose counts changed
+#are rewritten. Mutual information features are not touched- rerun feature_selection for those.
+#Each tweet's city and distance_km are filled in and saved along with the counts.
+#Workers keep serving the published model until publish_model runs- pass publish or call it once after a run of batches.
+def add_tweets(tweets, publish=False):
+    tweets = list(tweets)
+    city_ids, distances = data.assign_cities([tweet.longitude for tweet in tweets], [tweet.latitude for tweet in tweets])
+    tweet_cities = []
+    for i in range(0, len(tweets)):
+	tweet = tweets[i]
+	tweet.city = city_ids[i]
+	tweet.distance_km = distances[i]
+	session.add(tweet)
+	if tweet.city is not None and data.is_us_tweet(tweet):
+	    tweet_cities.append((tweet, data.CITIES_BY_ID[tweet.city]))
+    if not tweet_cities:
+	session.commit()
+	return 0
+
+    denominators = data.word_denominators()
+
+    term_deltas = dict((city.id, {}) for city in cities)
+    doc_deltas = dict((city.id, {}) for city in cities)
+    new_tweet_counts = dict((city.name, 0) for city in cities)
+    for tweet, city in tweet_cities:
+	words = [word.decode("utf-8") for word in tokenizer.tokenize(tweet.text)]
+	city_term_deltas = term_deltas[city.id]
+	for word in words:
+	    city_term_deltas[word] = city_term_deltas.get(word, 0) + 1
+	city_doc_deltas = doc_deltas[city.id]
+	for word in set(words):
+	    city_doc_deltas[word] = city_doc_deltas.get(word, 0) + 1
+	new_tweet_counts[city.name] += 1
+
+    new_words = corpus.add_counts(term_deltas, doc_deltas)
+    for city in cities:
+	save_container(data.region_tweet_count_key(city), data.create_region_tweet_count(city) + new_tweet_counts[city.name])
+    save_container('total_tweet_count', data.create_tweet_total_count() + len(tweet_cities))
+    add_to_heatmaps(tweet_cities)
+
+    changed_words = dict((city.name, set(term_deltas[city.id].keys())) for city in cities)
+    update_word_probabilities(denominators, changed_words, new_words)
+    data.save_word_denominators(denominators)
+    session.commit()
+    if publish:
+	publish_model()
+    print "added %d tweets to the model, %d new words" % (len(tweet_cities), len(new_words))
+    return len(tweet_cities)
+
+#P(W/City) = (count + 1)/(city word total + vocabulary size). A new tweet changes the denominator for every word in its city,
+#but rescaling every row on each batch would cost as much as the corpus- rows whose counts changed are recomputed against the
+#denominators the table is already normalized with and normalize_word_probabilities moves the whole table at publish time.
+#Counts are read back from city_word_counts for just the changed words
+def update_word_probabilities(denominators, changed_words, new_words):
+    for city in cities:
+	denominator = float(denominators[city.name])
+	word_counts = corpus.city_term_counts(city.id, changed_words[city.name] | new_words)
+	words = sorted(changed_words[city.name] - new_words)
+	for i in range(0, len(words), WORD_CHUNK_SIZE):
+	    chunk = words[i:i + WORD_CHUNK_SIZE]
+	    for word_instance in session.query(Word).filter(Word.city==city.name).filter(Word.word.in_(chunk)):
+		word_instance.probability = (word_counts.get(word_instance.word, 0) + 1.0)/denominator
+
+	for word in new_words:
+	    session.add(Word(word=word, city=city.name, probability=(word_counts.get(word, 0) + 1.0)/denominator))
+
+def save_container(key, value):
+    container = session.query(Container).filter(Container.key==key).first()
+    if container:
+	container.value = json.dumps(value)
+    else:
+	container = Container(key=key, value=json.dumps(value))
+    session.add(container)
+    data.cache.delete_many([key])
+
+#Counts the tweets of every city per map tile at each of heatmap.ZOOM_LEVELS, one container per zoom level mapping
+#city name -> [[tile x, tile y, # of tweets], ...]
+def build_heatmaps():
+    city_ids = []
+    lons = []
+    lats = []
+    for row in data.stream_query(data.us_tweets_query(Tweet.city, Tweet.longitude, Tweet.latitude).filter(Tweet.city!=None)):
+	city_ids.append(row.city)
+	lons.append(row.longitude)
+	lats.append(row.latitude)
+    for zoom in heatmap.ZOOM_LEVELS:
+	tile_counts = heatmap.tile_counts(city_ids, lons, lats, zoom)
+	save_container(data.heatmap_key(zoom), dict((city.name, tile_counts.get(city.id, [])) for city in cities))
+    session.commit()
+    print "built heatmaps of %d tweets" % len(city_ids)
+
+#Adds the tiles of new (tweet, city) pairs to the stored heatmaps
+def add_to_heatmaps(tweet_cities):
+    city_ids = [city.id for tweet, city in tweet_cities]
+    lons = [tweet.longitude for tweet, city in tweet_cities]
+    lats = [tweet.latitude for tweet, city in tweet_cities]
+    for zoom in heatmap.ZOOM_LEVELS:
+	stored = data.stored_heatmap(zoom) or {}
+	for city_id, new_tiles in heatmap.tile_counts(city_ids, lons, lats, zoom).items():
+	    city_name = data.CITIES_BY_ID[city_id].name
+	    tiles = dict(((x, y), count) for x, y, count in stored.get(city_name, []))
+	    for x, y, count in new_tiles:
+		tiles[(x, y)] = tiles.get((x, y), 0) + count
+	    stored[city_name] = [[x, y, count] for (x, y), count in sorted(tiles.items())]
+	save_container(data.heatmap_key(zoom), stored)
+
+#Writes the model_stats rows and the model artifact for the next model version and then bumps the version, so workers that
+#notice the new version find them already in place. Everything here is read from the db- this process's own cached statistics may be stale
+def publish_model():
+    stats.clear_caches()
+    data.cache.delete_many([data.region_tweet_count_key(city) for city in cities])
+    version = stats.next_model_version()
+    corpus_stats = stats.read_stats(version)
+    normalize_word_probabilities(corpus_stats.smoothing_denominators)
+    write_model_stats(corpus_stats)
+    if config.MODEL_ARTIFACT:
+	write_model_artifact(config.MODEL_ARTIFACT, corpus_stats)
+    return stats.bump_model_version(version)
+
+#Rescales the words table from the denominators its rows were written with to denominators (city name -> current denominator),
+#one UPDATE per city whose denominator changed since the table was last normalized
+def normalize_word_probabilities(denominators):
+    old_denominators = data.word_denominators()
+    for city in cities:
+	denominator = float(denominators[city.name])
+	old_denominator = float(old_denominators[city.name])
+	if denominator != old_denominator:
+	    session.query(Word).filter(Word.city==city.name).update({Word.probability: Word.probability * (old_denominator / denominator)}, synchronize_session=False)
+    data.save_word_denominators(dict((city.name, float(denominators[city.name])) for city in cities))
+    session.commit()
+
+#One model_stats row per city for corpus_stats.version, replacing the rows of the previous version
+def write_model_stats(corpus_stats):
+    session.query(ModelStats).delete(synchronize_session=False)
+    for city in cities:
+	session.add(ModelStats(city_id=city.id, city_name=city.name, version=corpus_stats.version,
+	    tweet_count=int(corpus_stats.city_tweet_counts[city.name]), token_count=int(corpus_stats.city_word_totals[city.name]),
+	    vocabulary_size=corpus_stats.city_vocabulary_sizes[city.name], log_prior=corpus_stats.log_priors[city.name],
+	    smoothing_denominator=corpus_stats.smoothing_denominators[city.name]))
+    session.commit()
+
+#Vocabulary hash table, (words x cities) term/doc count arrays, log-probability matrix, priors, scored words and feature ranks
+#(position of the word in each city's full feature ranking, -1 if it isn't ranked there)
+def write_model_artifact(path, corpus_stats):
+    version = corpus_stats.version
+    compiled_model = classifier.compile_model([corpus_stats.priors[city.name] for city in cities])
+    vocabulary = compiled_model.vocabulary
+    words = [None] * len(vocabulary)
+    for word, word_id in vocabulary.items():
+	words[word_id] = word
+
+    term_counts = np.zeros((len(words), len(cities)), dtype=np.int32)
+    doc_counts = np.zeros((len(words), len(cities)), dtype=np.int32)
+    city_term_counts, city_doc_counts = corpus.all_counts([city.id for city in cities])
+    for i, city in enumerate(cities):
+	for counts, city_counts in ((term_counts, city_term_counts[city.id]), (doc_counts, city_doc_counts[city.id])):
+	    for word, count in city_counts.items():
+		word_id = vocabulary.get(artifact.to_utf8(word))
+		if word_id is not None:
+		    counts[word_id, i] = count
+
+    arrays = {'term_counts': term_counts, 'doc_counts': doc_counts, 'log_probs': compiled_model.log_probs,
+	'log_priors': compiled_model.log_priors, 'scored': compiled_model.scored, 'feature_ranks': feature_selection.feature_rank_array(vocabulary)}
+    header = {'city_word_totals': corpus_stats.city_word_totals, 'city_vocabulary_sizes': corpus_stats.city_vocabulary_sizes,
+	'vocabulary_size': corpus_stats.vocabulary_size, 'city_tweet_counts': corpus_stats.city_tweet_counts,
+	'total_tweet_count': corpus_stats.total_tweet_count, 'priors': corpus_stats.priors}
+    artifact.write_artifact(path, version, compiled_model.city_names, words, arrays, header)
+    print "wrote model artifact version %d to %s" % (version, path)
@@ -1,4 +1,4 @@
-from flask import Flask, flash, render_template, redirect, request, session, url_for,g
+from flask import Flask, flash, render_template, redirect, request, session, url_for,g, jsonify, abort
 #from model import session as db_session, Tweet
 from flask.ext.sqlalchemy import SQLAlchemy
 #import model
@@ -8,54 +8,85 @@ import datetime
 from data import cities
 import os
 import feature_selection
+import stats
+import heatmap
+import tokenizer
+import hashlib
+from cache import LRUCache
+import classifier
+import numpy as np
+from app import db
 
 app = Flask(__name__)
 app.config.from_object(__name__)
 app.secret_key = 'some_key'
 app.config['DEBUG'] = True
+#Number of classify_text results each worker keeps
+CLASSIFY_RESULTS_SIZE = 5000
 # Adding comment
 
+#Renders without touching the corpus- the page fetches its map data from /map_data once it has loaded
 @app.route("/")
 def index():
-    tweet_city_dict = data.map_cities_to_tweets()
-    return render_template("home.html", tweet_city_dict=tweet_city_dict)
+    return render_template("home.html")
+
+#Every city's position and tweet count for the home page map, cached per model version
+@app.route("/map_data", methods=["GET"])
+def map_data():
+    response = jsonify(cities=data.map_data())
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
 @app.route("/about_project")
 def project_page():
     return render_template("about_project.html")
 
+#Rankings and feature strings of recently classified texts. Ranking and feature explanations only depend on a text's words,
+#so texts with the same words in any order, case or punctuation share an entry
+CLASSIFY_RESULTS = LRUCache(CLASSIFY_RESULTS_SIZE)
+
+#Hash of the text's sorted words, repeats included, for one model version
+def classify_result_key(tweet, version):
+    words = sorted(tokenizer.tokenize(tweet))
+    return '%d:%s' % (version, hashlib.sha1(' '.join(words)).hexdigest())
+
 @app.route("/classify_text", methods=["POST"])
 def classify_text():
     tweet = request.form['tweet']
 
     start = datetime.datetime.now()
-    rankings = data.create_ranking(tweet)
+    #every city's counts come from the worker's in-memory model statistics, no queries
+    corpus_stats = stats.get_stats()
+    #results are keyed by the version of the model they are scored with. The feature index reloads on its own clock, so a
+    #result is only stored when both were on that version
+    classifier.get_model()
+    feature_selection.get_feature_index()
+    version = classifier.MODEL.version
+    result_key = classify_result_key(tweet, version)
+    result = CLASSIFY_RESULTS.get(result_key)
+    if result:
+	rankings, feature_strings_dict = result
+    else:
+	rankings = data.create_ranking(tweet)
+	feature_ranks = feature_selection.tweet_feature_ranks(tweet)
+	feature_strings_dict = {}
+	for city in cities:
+	    feature_strings = feature_selection.included_feature_strings(city, tweet, feature_ranks)
+	    feature_strings_dict[city.name] = feature_strings
+	if classifier.MODEL.version == version and feature_selection.FEATURE_INDEX.version == version:
+	    CLASSIFY_RESULTS.set(result_key, (rankings, feature_strings_dict))
     end = datetime.datetime.now()
-    print 'getting city rankings takes: %s' % (end - start)
-    
+    print 'getting city rankings and top words takes: %s' % (end - start)
 
-    start = datetime.datetime.now()
-    feature_strings_dict = {}
     city_corpus_leng_dict = {}
     city_tweet_count_dict = {}
     for city in cities:
-	corpus_leng = data.find_leng_city_corpus(city)
+	corpus_leng = corpus_stats.city_vocabulary_sizes[city.name]
 	city_corpus_leng_dict[city.name] = corpus_leng
 	
-	city_tweet_count = data.create_region_tweet_count(city)
+	city_tweet_count = corpus_stats.city_tweet_counts[city.name]
 	city_tweet_count_dict[city.name] = city_tweet_count
 
-	feature_strings = feature_selection.included_feature_strings(city, tweet)
-	feature_strings_dict[city.name] = feature_strings
-    end = datetime.datetime.now()
-    print 'getting top 5 words takes: %s' % (end - start)
-   
-    start = datetime.datetime.now()
-    cty_corpus_dict = data.city_corpus_dict()
-    word_count_dict = cty_corpus_dict[rankings[0][0].name]
-    end = datetime.datetime.now()
-    print 'getting bogus word count dict takes: %s' % (end - start)
-
     start = datetime.datetime.now()
     names = []
     for i in range(0, len(rankings)):
@@ -65,6 +96,62 @@ def classify_text():
     print 'generating lists takes: %s' % (end - start)
     return render_template("map.html", tweet=tweet, city_tweet_count_dict=city_tweet_count_dict, names=names, city_corpus_leng_dict=city_corpus_leng_dict, feature_strings_dict=feature_strings_dict, rankings=rankings)
 
+#JSON scoring for machine clients: takes text (form, query string or {"text": ...}) and returns every city ranked with its
+#log score and normalized probability. With contributions=true also returns each scored word's count and log score per city.
+#Nothing the map page needs is computed
+@app.route("/api/classify", methods=["GET", "POST"])
+def api_classify():
+    if request.json is not None and not isinstance(request.json, dict):
+	abort(400)
+    params = request.json if request.json else request.values
+    text = params.get('text')
+    if not isinstance(text, basestring):
+	abort(400)
+    compiled_model = classifier.get_model()
+    scores = compiled_model.scores(text)
+    probabilities = classifier.softmax(scores)
+    ranked_cities = []
+    for i in np.argsort(-scores, kind='mergesort'):
+	ranked_cities.append({'city': compiled_model.city_names[i], 'log_score': float(scores[i]), 'probability': float(probabilities[i])})
+    result = {'model_version': classifier.MODEL.version, 'cities': ranked_cities}
+    if params.get('contributions') in (True, 'true', '1'):
+	contributions = {}
+	for word, (count, log_scores) in compiled_model.contributions(text).items():
+	    contributions[word] = {'count': count, 'log_scores': dict(zip(compiled_model.city_names, log_scores.tolist()))}
+	result['contributions'] = contributions
+    return jsonify(result)
+
+#Takes {"tweets": [...]} and returns the ranking of every city for each tweet, in the same order
+@app.route("/classify_batch", methods=["POST"])
+def classify_batch():
+    if not isinstance(request.json, dict) or not isinstance(request.json.get('tweets'), list):
+	abort(400)
+    tweets = request.json['tweets']
+    if not all(isinstance(tweet, basestring) for tweet in tweets):
+	abort(400)
+    rankings = data.classify_many(tweets)
+    results = []
+    for ranking in rankings:
+	results.append([{'city': city.name, 'score': score} for city, score in ranking])
+    return jsonify(rankings=results)
+
+#Maps city name to [[tile x, tile y, # of tweets], ...] for the map tiles at zoom, one of heatmap.ZOOM_LEVELS
+@app.route("/heatmap/<int:zoom>", methods=["GET"])
+def heatmap_tiles(zoom):
+    if zoom not in heatmap.ZOOM_LEVELS:
+	abort(404)
+    tiles = data.heatmap(zoom)
+    if tiles is None:
+	abort(404)
+    response = jsonify(zoom=zoom, cities=tiles)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+#Hit and miss counters of the cache tiers in this worker
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify(data.cache.stats(), classify_results=CLASSIFY_RESULTS.stats())
+
 @app.route("/classify_text", methods=["GET"])
 def classify():
     return redirect(url_for("index"))
@@ -86,7 +173,7 @@ def list_features(city_name):
 	latitude = city.lat
 	longitude = city.lon
 	city_name = city.name
-	city_tweet_count = data.create_region_tweet_count(city)
+	city_tweet_count = data.region_tweet_counts()[city.name]
 	city_word_count = data.find_leng_city_corpus(city)
     return render_template("city_words.html", features= feature_list, city_name=city_name, latitude=latitude, longitude=longitude, city_tweet_count=city_tweet_count, city_word_count=city_word_count)
 
@@ -107,5 +194,34 @@ def mi_tutorial():
     return render_template("mi1.html")
 
 
+#Set once warm_up has built everything the pages need. /ready reports it so traffic is only sent to warm workers
+READY = False
+
+#Builds the statistics snapshot, classification model, top features and feature index up front instead of on the first
+#request that needs them. Called by gunicorn's on_starting hook before the workers are forked (see gunicorn_config.py)
+def warm_up():
+    global READY
+    start = datetime.datetime.now()
+    stats.get_stats()
+    classifier.get_model()
+    data.get_set_of_words()
+    feature_selection.get_feature_index()
+    READY = True
+    end = datetime.datetime.now()
+    print 'warming up takes: %s' % (end - start)
+
+#Called in every worker right after the fork
+def after_fork():
+    db.session.remove()
+    db.engine.dispose()
+    data.cache.client.disconnect_all()
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    if not READY:
+	return jsonify(ready=False), 503
+    return jsonify(ready=True, model_version=stats.get_stats().version)
+
 if __name__ == "__main__":
+    warm_up()
     app.run(debug=True)
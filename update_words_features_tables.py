@@ -1,23 +1,34 @@
 import data
 import feature_selection
+import seed
+import training
 from data import cities
 
 #Before running this file:
 #Upon reseeding DB tweets table with new data:
-#DELETE from features, words, and containers tables. Note: I have set indexes on 'longitude' and 'latitude' in the tweets table, and on 'city' and 'word' 
+#DELETE from features, words, and containers tables, except the 'model_version' container (vocabulary and city_word_counts are replaced by build_city_word_counts). Note: I have set indexes on 'longitude' and 'latitude' in the tweets table, and on 'city' and 'word' 
     # from words table to increase speed in text classification 
 #Call this file to repopulate those tables with up to date values 
+#To fold batches of new tweets into the existing tables instead of rebuilding them, call training.add_tweets(tweets) for each batch,
+#then rerun feature selection and training.publish_model() once- workers keep serving the published model until then
 
 def main(): 
     
-    data.city_corpus_dict()
+    #fills in tweets.city for tweets loaded before the column existed
+    seed.assign_cities_to_tweets()
+    #counts every word of every city into the vocabulary and city_word_counts tables
+    data.build_city_word_counts()
     #seeds words table with city, word, prob(w/city)
     data.seed_words_table()
-    data.city_tweet_corpus_dict()
     for city in cities:
 	data.create_region_tweet_count(city)
-	feature_selection.populate_db_with_features(city)
     data.create_tweet_total_count()
+    #ranks the features of every city in one pass
+    feature_selection.populate_db_with_all_features()
+    #tweets per map tile for the /heatmap endpoint
+    training.build_heatmaps()
+    #writes the model artifact and tells every running worker to reload its statistics and model
+    training.publish_model()
 
 if __name__ == "__main__":
         main()